@@ -3,13 +3,24 @@ load_dotenv()
 
 import logging
 from config import get_config_all, load_config, save_config, set_config
-from flask import Flask, Response, jsonify, request, send_file
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 import os
-from werkzeug.exceptions import HTTPException
+import shutil
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
 import json
 from task import VideoCreationOptions, VideoTask
-from concurrent.futures import ThreadPoolExecutor
+from clip_cache import clip_cache
+from script_cache import script_cache
+from tts_cache import tts_cache
+from video_providers import get_video_router
+from encoding import get_encoding_profile
+from ingest import MAX_UPLOAD_BYTES, InvalidImage, UploadTooLarge, get_image_ext, ingest_image
+from job_queue import JobRunner
+from metrics import render_metrics
+from serving import send_task_file
+from thumbnail import DEFAULT_THUMBNAIL_WIDTH, FORMAT_JPEG, FORMAT_WEBP, MIME_TYPES, SOURCE_IMAGE, THUMBNAIL_SOURCES, \
+    get_thumbnail, snap_width
 
 FLASK_HOST = os.environ.get("FLASK_HOST", "")
 if not FLASK_HOST:
@@ -18,13 +29,38 @@ FLASK_PORT = int(os.environ.get("FLASK_PORT", "!"))
 if not FLASK_PORT:
     raise ValueError("FLASK_PORT is not set")
 
+THUMBNAIL_MAX_AGE = 365 * 24 * 3600
+POSTER_MAX_AGE = 3600
+
 app = Flask(__name__)
-CORS(app)
+# 요청 전체 크기 제한은 werkzeug가 multipart를 읽는 동안 적용합니다.
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES + 1024 * 1024
+CORS(app, expose_headers=["X-Next-Cursor"])
+
+job_runner = JobRunner()
+job_runner.start_recovery()
 
 @app.route("/api/tasks", methods=["GET"])
 def get_tasks():
-    tasks = VideoTask.load_all()
-    return jsonify([task.to_dict() for task in tasks])
+    try:
+        limit = request.args.get("limit", type=int)
+        cursor = request.args.get("cursor") or None
+        status = request.args.get("status", "")
+        status_list = [value for value in status.split(",") if value]
+        descending = request.args.get("order", "desc") != "asc"
+        tasks, next_cursor = VideoTask.query_index(limit, cursor, status_list, descending)
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+
+    response = jsonify(tasks)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+@app.route("/api/tasks/reindex", methods=["POST"])
+def post_reindex_tasks():
+    count = VideoTask.rebuild_index()
+    return jsonify({"status": "success", "count": count})
 
 @app.route("/api/tasks", methods=["POST"])
 def create():
@@ -39,16 +75,32 @@ def create():
             raise HTTPException(status_code=400, detail="No images selected")
 
         video_options = VideoCreationOptions(**json.loads(request.form.get("options")))
+        try:
+            get_encoding_profile(video_options.encoding_profile)
+        except ValueError as e:
+            return jsonify({"status": "error", "error": str(e)}), 400
         video_task = VideoTask.create_new(video_options)
-        for file in files:
-            file_ext = os.path.splitext(file.filename)[1]
-            file_path = video_task.add_image(file_ext)
-            file.save(file_path)
-
-        print(f"start {video_task.task_id}")
-        video_task.run()
+        try:
+            total_bytes = 0
+            for file in files:
+                temp_path = video_task.get_upload_temp_path()
+                image_info = ingest_image(file.stream, temp_path, uploaded_bytes=total_bytes)
+                total_bytes += image_info.size
+                file_ext = get_image_ext(file.filename, image_info.mime_type)
+                file_path = video_task.add_image(file_ext, image_info)
+                os.replace(temp_path, file_path)
+        except Exception:
+            shutil.rmtree(video_task.get_work_dir(), ignore_errors=True)
+            raise
+
+        video_task.save_info()
+        job_runner.submit(video_task.task_id)
         return jsonify({"status": "success", "id": video_task.task_id})
 
+    except (UploadTooLarge, RequestEntityTooLarge) as e:
+        return jsonify({"status": "error", "error": str(e)}), 413
+    except InvalidImage as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
     except Exception as e:
         logging.exception("/api/create")
         return jsonify({"status": "error", "error": str(e)}), 500
@@ -56,7 +108,7 @@ def create():
 @app.route("/api/tasks/<task_id>", methods=["GET"])
 def get_task(task_id):
     try:
-        video_task = VideoTask.resume_from(task_id)
+        video_task = VideoTask.load_cached(task_id)
         serialized_task = video_task.serialize()
         return Response(serialized_task, mimetype="application/json")
 
@@ -67,23 +119,92 @@ def get_task(task_id):
 @app.route("/api/tasks/<task_id>/result", methods=["GET"])
 def get_result(task_id):
     try:
-        video_task = VideoTask.resume_from(task_id)
+        video_task = VideoTask.load_cached(task_id)
         video_path = video_task.get_final_video_path()
-        return send_file(video_path)        
+        return send_task_file(video_path, mimetype="video/mp4")
     except Exception as e:
         logging.exception("/api/tasks/<task_id>/result")
         return jsonify({"status": "error", "error": str(e)}), 500
 
-@app.route("/api/tasks/<task_id>/thumbnail", methods=["GET"])
-def get_thumbnail(task_id):
+@app.route("/api/tasks/<task_id>/preview", methods=["GET"])
+def get_preview(task_id):
+    try:
+        video_task = VideoTask.load_cached(task_id)
+        video_path = video_task.get_preview_video_path()
+        return send_task_file(video_path, mimetype="video/mp4")
+    except Exception as e:
+        logging.exception("/api/tasks/<task_id>/preview")
+        return jsonify({"status": "error", "error": str(e)}), 500
+
+@app.route("/api/tasks/<task_id>/approve", methods=["POST"])
+def post_approve(task_id):
+    try:
+        video_task = VideoTask.resume_from(task_id)
+        video_task.approve()
+        job_runner.submit(video_task.task_id)
+        return jsonify({"status": "success", "id": video_task.task_id})
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 409
+    except Exception as e:
+        logging.exception("/api/tasks/<task_id>/approve")
+        return jsonify({"status": "error", "error": str(e)}), 500
+
+@app.route("/api/tasks/<task_id>/reject", methods=["POST"])
+def post_reject(task_id):
     try:
         video_task = VideoTask.resume_from(task_id)
-        thumbnail = video_task.get_thumbnail_image_path()
-        return send_file(thumbnail)
+        video_task.reject()
+        return jsonify({"status": "success", "id": video_task.task_id})
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 409
+    except Exception as e:
+        logging.exception("/api/tasks/<task_id>/reject")
+        return jsonify({"status": "error", "error": str(e)}), 500
+
+@app.route("/api/tasks/<task_id>/thumbnail", methods=["GET"])
+def get_task_thumbnail(task_id):
+    source = request.args.get("source", SOURCE_IMAGE)
+    if source not in THUMBNAIL_SOURCES:
+        return jsonify({"status": "error", "error": f"Unknown thumbnail source: {source}"}), 400
+    try:
+        video_task = VideoTask.load_cached(task_id)
+        width = request.args.get("w", DEFAULT_THUMBNAIL_WIDTH, type=int)
+        if width <= 0 and source == SOURCE_IMAGE:
+            # w=0 은 업로드한 원본을 그대로 돌려줍니다.
+            thumbnail = video_task.get_thumbnail_image_path()
+            return send_task_file(thumbnail, max_age=THUMBNAIL_MAX_AGE, immutable=True)
+
+        fmt = request.args.get("format", "")
+        if fmt not in MIME_TYPES:
+            fmt = FORMAT_WEBP if request.accept_mimetypes.accept_webp else FORMAT_JPEG
+        thumbnail = get_thumbnail(video_task, source, snap_width(width), fmt)
+
+        # 업로드 이미지는 바뀌지 않으므로 브라우저가 다시 확인하지 않게 합니다.
+        response = send_task_file(
+            thumbnail,
+            mimetype=MIME_TYPES[fmt],
+            max_age=THUMBNAIL_MAX_AGE if source == SOURCE_IMAGE else POSTER_MAX_AGE,
+            immutable=source == SOURCE_IMAGE)
+        response.vary.add("Accept")
+        return response
     except Exception as e:
         logging.exception("/api/tasks/<task_id>/thumbnail")
         return jsonify({"status": "error", "error": str(e)}), 500
 
+@app.route("/api/stats", methods=["GET"])
+def get_stats():
+    return jsonify({
+        "clip_cache": clip_cache.stats(),
+        "tts_cache": tts_cache.stats(),
+        "script_cache": script_cache.stats(),
+        "video_providers": get_video_router().to_dict(),
+    })
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    body, content_type = render_metrics()
+    return Response(body, headers={"Content-Type": content_type})
+
 @app.route("/api/config", methods=["GET"])
 def get_config():
     return jsonify(get_config_all())
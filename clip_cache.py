@@ -0,0 +1,22 @@
+import hashlib
+import os
+
+from disk_cache import DiskCache, make_cache_key
+
+DATA_PATH = os.environ.get("DATA_PATH", "")
+CLIP_CACHE_PATH = os.environ.get("CLIP_CACHE_PATH", "") or os.path.join(DATA_PATH, "_cache", "clips")
+CLIP_CACHE_MAX_BYTES = int(os.environ.get("CLIP_CACHE_MAX_BYTES", str(10 * 1024 * 1024 * 1024)))
+
+clip_cache = DiskCache(CLIP_CACHE_PATH, CLIP_CACHE_MAX_BYTES, ".mp4")
+
+
+def get_file_sha256(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def get_clip_cache_key(image_sha256: str, prompt: str, provider: str, resolution: str, length_sec: int) -> str:
+    return make_cache_key("clip", image_sha256, prompt, provider, resolution, length_sec)
@@ -13,11 +13,24 @@ def get_config_all():
         load_config()
     return config
 
-def get_config(key: str):
+_MISSING = object()
+
+def get_config(key: str, default=_MISSING):
     if not is_config_loaded:
         load_config()
+    if default is not _MISSING:
+        return config.get(key, default)
     return config[key]
 
+TRUE_VALUES = ("true", "1", "yes", "on")
+
+def get_config_bool(key: str, default: bool = False) -> bool:
+    """ /api/config 로 저장하면 "true" / "True" / "1" 같은 문자열이 될 수 있어서 함께 받습니다. """
+    value = get_config(key, default)
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_VALUES
+    return bool(value)
+
 def set_config(key: str, value: str):
     config[key] = value
 
@@ -4,17 +4,40 @@ import os
 import random
 import time
 from PIL import Image
-import requests
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dee_poller import DeeWaitCancelled, get_dee_poller
+from http_session import CONNECT_TIMEOUT_SEC, DEFAULT_TIMEOUT, READ_TIMEOUT_SEC, get_session
+from metrics import timed_call
+
+DEE_PROVIDER = "dee"
+DEE_RESOLUTION = "480p"
+DEE_LENGTH_SEC = 5
 
 DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/139.0.0.0 Safari/537.36"
 
+DEFAULT_PACING_SEC = 1.0
+DEFAULT_TIMEOUT_SEC = 120
+# 이미지 업로드는 본문이 커서 응답까지 더 오래 걸릴 수 있습니다.
+UPLOAD_TIMEOUT = (CONNECT_TIMEOUT_SEC, 120)
+CANCEL_CHECK_SEC = 1.0
+
 class DeeClient:
-    def __init__(self, token, user_agent):
+    def __init__(self, token, user_agent, pacing_sec: float = DEFAULT_PACING_SEC):
+        """
+        :param pacing_sec: report/upload/submit 요청 사이에 쉬는 시간 (0이면 쉬지 않음)
+        """
         self.token = token
         self.user_agent = user_agent
+        self.pacing_sec = pacing_sec
+        self.session = get_session()
+
+    def pace(self):
+        if self.pacing_sec > 0:
+            time.sleep(self.pacing_sec)
 
+    @timed_call(DEE_PROVIDER, "report")
     def request_report(self, event_type: str):
-        r = requests.post(
+        r = self.session.post(
             "https://api.deevid.ai/event/report",
             headers={
                 "Accept": "application/json, text/plain, */*",
@@ -35,6 +58,7 @@ class DeeClient:
                     "user_type": "free",
                 },
             },
+            timeout=DEFAULT_TIMEOUT,
         )
 
         if not r.ok:
@@ -42,6 +66,7 @@ class DeeClient:
             print(f"Response Text: {r.text}")
             raise Exception("request_report: not ok")
 
+    @timed_call(DEE_PROVIDER, "upload")
     def request_image(self, file_name: str, file_path: str, mime_type: str, width: int, height: int):
         headers_payload = {
             "Accept": "application/json, text/plain, */*",
@@ -60,8 +85,8 @@ class DeeClient:
             files_payload = {"file": (file_name, f, mime_type)}
             #url = "https://httpbin.org/post"
             url = "https://api.deevid.ai/file-upload/image"
-            r = requests.post(
-                url, headers=headers_payload, data=data_payload, files=files_payload
+            r = self.session.post(
+                url, headers=headers_payload, data=data_payload, files=files_payload, timeout=UPLOAD_TIMEOUT
             )
 
         if not r.ok:
@@ -78,6 +103,7 @@ class DeeClient:
             print(f"Error response: {res}")
             raise Exception(f"Failed to parse image response: {res}")
 
+    @timed_call(DEE_PROVIDER, "submit")
     def request_submit(self, prompt: str, imageId: int):
         headers_payload = {
             "Accept": "application/json, text/plain, */*",
@@ -91,18 +117,19 @@ class DeeClient:
         json_payload = {
             "userImageId": imageId,
             "prompt": prompt,
-            "lengthOfSecond": 5,
-            "resolution": "480p",
+            "lengthOfSecond": DEE_LENGTH_SEC,
+            "resolution": DEE_RESOLUTION,
             "aiPromptEnhance": True,
             "addEndFrame": False,
         }
 
         url = "https://api.deevid.ai/image-to-video/task/submit"
         #url = "https://httpbin.org/post"
-        r = requests.post(
+        r = self.session.post(
             url,
             headers=headers_payload,
-            json=json_payload
+            json=json_payload,
+            timeout=DEFAULT_TIMEOUT
         )
 
         if not r.ok:
@@ -119,7 +146,8 @@ class DeeClient:
             print(f"Error response: {res}")
             raise Exception(f"Failed to parse submit response: {res}")
 
-    def request_tasks(self):
+    @timed_call(DEE_PROVIDER, "tasks")
+    def request_tasks(self, page: int = 1, size: int = 20):
         headers_payload = {
             "Accept": "application/json, text/plain, */*",
             "Accept-Language": "ko-KR,ko;q=0.9,en-US;q=0.8,en;q=0.7",
@@ -129,9 +157,9 @@ class DeeClient:
             "user-agent": self.user_agent,
         }
 
-        url = "https://api.deevid.ai/video/tasks?page=1&size=20"
+        url = f"https://api.deevid.ai/video/tasks?page={page}&size={size}"
         #url = "https://httpbin.org/get"
-        r = requests.get(url, headers=headers_payload)
+        r = self.session.get(url, headers=headers_payload, timeout=DEFAULT_TIMEOUT)
 
         if not r.ok:
             print(f"Status Code: {r.status_code}")
@@ -188,28 +216,43 @@ class DeeClient:
             width, height = img.size
             return width, height
 
-    def dee_video(self, prompt: str, image_path: str):
+    def upload_image(self, image_path: str, width: int = None, height: int = None, mime_type: str = None):
+        """ width/height/mime_type을 넘기면 (업로드 시 읽어둔 값) 이미지를 다시 열지 않습니다. """
         self.request_report("choose_media")
-        time.sleep(1)
+        self.pace()
         self.request_report("begin_upload_media")
-        time.sleep(1)
+        self.pace()
         filename = self.get_random_image_file_name(image_path)
-        mimetype = self.get_mime_type(image_path)
-        width, height = self.get_image_size(image_path)
-        image_id = self.request_image(filename, image_path, mimetype, width, height)
-        time.sleep(1)
-        submit_id = self.request_submit(prompt, image_id)
+        mimetype = mime_type or self.get_mime_type(image_path)
+        if not width or not height:
+            width, height = self.get_image_size(image_path)
+        return self.request_image(filename, image_path, mimetype, width, height)
 
-        start_time = time.time()
+    @timed_call(DEE_PROVIDER, "wait")
+    def wait_video(self, submit_id, timeout_sec: float = DEFAULT_TIMEOUT_SEC, cancel_event=None):
+        """
+        토큰별 공유 poller에 submit id를 맡기고 videoUrl이 나올 때까지 기다립니다.
+        cancel_event가 set되면 기다리기를 그만두고 DeeWaitCancelled를 던집니다. (작업 자체는 poller에 남습니다.)
+        """
+        poller = get_dee_poller(self.token, self.request_tasks)
+        future = poller.watch(submit_id, timeout_sec)
+        # poller가 deadline에 만료시키지만, poller 스레드가 멈춰도 토큰을 계속 쥐고 있지 않도록 한 번 더 제한합니다.
+        deadline = time.time() + timeout_sec + READ_TIMEOUT_SEC
         while True:
-            if time.time() - start_time > 120:
-                raise Exception("dee_video: timeout")
-
-            time.sleep(6)
-            tasks = self.request_tasks()
-            for task in tasks:
-                if task["id"] == submit_id and task["taskState"] == "SUCCESS":
-                    return task["videoUrl"]
+            try:
+                return future.result(timeout=max(0.0, min(CANCEL_CHECK_SEC, deadline - time.time())))
+            except FutureTimeoutError:
+                if future.done() or time.time() >= deadline:
+                    raise
+                if cancel_event is not None and cancel_event.is_set():
+                    raise DeeWaitCancelled(f"dee_video: wait for {submit_id} cancelled")
+
+    def dee_video(self, prompt: str, image_path: str, width: int = None, height: int = None, mime_type: str = None,
+                  timeout_sec: float = DEFAULT_TIMEOUT_SEC):
+        image_id = self.upload_image(image_path, width, height, mime_type)
+        self.pace()
+        submit_id = self.request_submit(prompt, image_id)
+        return self.wait_video(submit_id, timeout_sec)
 
 if __name__ == "__main__":
     with open("token-20.txt", "r") as f:
@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+PAGE_SIZE = 20
+MAX_PAGES = 10
+MIN_INTERVAL_SEC = 3.0
+MAX_INTERVAL_SEC = 20.0
+BACKOFF = 1.5
+INITIAL_COMPLETION_SEC = 45.0
+COMPLETION_ALPHA = 0.3
+
+DEE_SUCCESS_STATE = "SUCCESS"
+DEE_FAILED_STATES = {"FAIL", "FAILED", "ERROR"}
+
+
+class DeeTaskFailed(Exception):
+    pass
+
+
+class DeeWaitCancelled(Exception):
+    pass
+
+
+class PendingJob:
+    def __init__(self, submit_id, timeout_sec: float):
+        self.submit_id = submit_id
+        self.future = Future()
+        self.submitted_at = time.time()
+        self.deadline = self.submitted_at + timeout_sec
+
+
+class DeePoller:
+    """
+    토큰 하나의 진행 중인 submit id들을 한 스레드에서 모아 조회합니다.
+    필요한 만큼 페이지를 넘겨 찾고, 평균 완료 시간에 맞춰 조회 간격을 조절합니다.
+    """
+
+    def __init__(self, fetch_tasks: Callable[[int, int], list]):
+        """
+        :param fetch_tasks: (page, size) -> Dee task 목록
+        """
+        self.fetch_tasks = fetch_tasks
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.typical_completion_sec = INITIAL_COMPLETION_SEC
+        self.idle_polls = 0
+        self.poll_count = 0
+
+    def watch(self, submit_id, timeout_sec: float) -> Future:
+        """ submit id를 등록하고 videoUrl로 완료되는 Future를 돌려줍니다. """
+        with self.lock:
+            job = self.pending.get(submit_id)
+            if job is None:
+                job = PendingJob(submit_id, timeout_sec)
+                self.pending[submit_id] = job
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="dee-poller", daemon=True)
+                self.thread.start()
+        return job.future
+
+    def next_delay(self) -> float:
+        with self.lock:
+            if not self.pending:
+                return 0
+            now = time.time()
+            expected_at = min(job.submitted_at for job in self.pending.values()) + self.typical_completion_sec
+        until_expected = expected_at - now
+        if until_expected > MIN_INTERVAL_SEC:
+            # 가장 먼저 끝날 것으로 보이는 작업 직전까지는 조회하지 않습니다.
+            return min(until_expected, MAX_INTERVAL_SEC)
+        return min(MIN_INTERVAL_SEC * (BACKOFF ** self.idle_polls), MAX_INTERVAL_SEC)
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.next_delay())
+            self.wakeup.clear()
+            with self.lock:
+                if not self.pending:
+                    self.thread = None
+                    return
+            try:
+                self.poll_once()
+            except Exception as e:
+                logging.error(f"dee poller: {e}")
+                self.idle_polls += 1
+            self.expire()
+
+    def poll_once(self):
+        with self.lock:
+            remaining = set(self.pending)
+        completed = 0
+        page = 1
+        while remaining and page <= MAX_PAGES:
+            tasks = self.fetch_tasks(page, PAGE_SIZE)
+            self.poll_count += 1
+            for task in tasks:
+                submit_id = task.get("id")
+                if submit_id not in remaining:
+                    continue
+                remaining.discard(submit_id)
+                state = task.get("taskState")
+                if state == DEE_SUCCESS_STATE:
+                    self.resolve(submit_id, result=task.get("videoUrl"))
+                    completed += 1
+                elif state in DEE_FAILED_STATES:
+                    self.resolve(submit_id, error=DeeTaskFailed(f"dee_video: task {submit_id} {state}"))
+                    completed += 1
+            if len(tasks) < PAGE_SIZE:
+                break
+            page += 1
+        self.idle_polls = 0 if completed else self.idle_polls + 1
+
+    def resolve(self, submit_id, result=None, error: Exception = None):
+        with self.lock:
+            job = self.pending.pop(submit_id, None)
+        if job is None:
+            return
+        if error is not None:
+            job.future.set_exception(error)
+            return
+        elapsed = time.time() - job.submitted_at
+        self.typical_completion_sec += COMPLETION_ALPHA * (elapsed - self.typical_completion_sec)
+        job.future.set_result(result)
+
+    def expire(self):
+        now = time.time()
+        with self.lock:
+            expired = [job for job in self.pending.values() if job.deadline < now]
+            for job in expired:
+                del self.pending[job.submit_id]
+        for job in expired:
+            job.future.set_exception(TimeoutError(f"dee_video: timeout ({job.submit_id})"))
+
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+
+def get_dee_poller(token: str, fetch_tasks: Callable[[int, int], list]) -> DeePoller:
+    """ 토큰마다 하나의 poller를 공유합니다. """
+    with _pollers_lock:
+        poller = _pollers.get(token)
+        if poller is None:
+            poller = DeePoller(fetch_tasks)
+            _pollers[token] = poller
+        return poller
@@ -0,0 +1,174 @@
+import hashlib
+import threading
+import time
+
+from config import get_config
+
+HEALTH_ALPHA = 0.2
+CANCEL_CHECK_SEC = 1.0
+
+
+class DeeAcquireCancelled(Exception):
+    pass
+
+
+def parse_token_list(value) -> list[str]:
+    """ config 값은 리스트이거나 /api/config 로 저장된 쉼표 구분 문자열일 수 있습니다. """
+    if isinstance(value, str):
+        value = value.split(",")
+    return [token.strip() for token in value if token and token.strip()]
+
+
+class DeeToken:
+    def __init__(self, token: str):
+        self.token = token
+        # info.json 등에 남겨도 되는 토큰 식별자
+        self.token_id = hashlib.sha256(token.encode("utf-8")).hexdigest()[:12]
+        self.inflight = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.health = 1.0
+        self.open_until = 0.0
+        self.half_open_trial = False
+
+    def is_available(self, max_inflight: int, now: float) -> bool:
+        if self.inflight >= max_inflight:
+            return False
+        if self.open_until > now:
+            return False
+        if self.open_until and self.half_open_trial:
+            # half-open 상태에서는 시험 요청 하나만 허용합니다.
+            return False
+        return True
+
+    def to_dict(self):
+        return {
+            "token_id": self.token_id,
+            "inflight": self.inflight,
+            "successes": self.successes,
+            "failures": self.failures,
+            "health": round(self.health, 3),
+            "circuit_open": self.open_until > time.time(),
+        }
+
+
+class DeeTokenPool:
+    """
+    Dee 토큰 풀입니다. 토큰마다 동시 요청 수를 제한하고,
+    성공/실패로 health 점수를 갱신하며, 연속 실패한 토큰은 circuit breaker로 잠시 제외합니다.
+    """
+
+    def __init__(self, tokens: list[str], max_inflight: int = 1, breaker_threshold: int = 3,
+                 breaker_cooldown_sec: float = 300):
+        if not tokens:
+            raise ValueError("No dee token configured")
+        self.tokens = [DeeToken(token) for token in tokens]
+        self.max_inflight = max_inflight
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown_sec = breaker_cooldown_sec
+        self.condition = threading.Condition()
+
+    def capacity(self) -> int:
+        return len(self.tokens) * self.max_inflight
+
+    def available_count(self) -> int:
+        """ 지금 바로 빌릴 수 있는 자리 수입니다. """
+        with self.condition:
+            now = time.time()
+            return sum(self.max_inflight - token.inflight for token in self.tokens
+                       if token.is_available(self.max_inflight, now))
+
+    def find(self, token_id: str):
+        for token in self.tokens:
+            if token.token_id == token_id:
+                return token
+        return None
+
+    def pick(self, now: float, token_id: str = None):
+        candidates = [token for token in self.tokens
+                      if token.is_available(self.max_inflight, now)
+                      and (token_id is None or token.token_id == token_id)]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda token: (token.health, -token.inflight))
+
+    def acquire(self, timeout: float = None, token_id: str = None, cancel_event: threading.Event = None) -> DeeToken:
+        """
+        사용할 수 있는 토큰 중 health가 가장 높은 토큰을 빌립니다. token_id를 주면 그 토큰만 기다립니다.
+        기다리는 동안 cancel_event가 set되면 DeeAcquireCancelled를 던집니다.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while True:
+                now = time.time()
+                token = self.pick(now, token_id)
+                if token:
+                    token.inflight += 1
+                    if token.open_until:
+                        token.half_open_trial = True
+                    return token
+                if cancel_event is not None and cancel_event.is_set():
+                    raise DeeAcquireCancelled("dee token wait cancelled")
+                if deadline is not None and now >= deadline:
+                    raise TimeoutError("No dee token available")
+                # circuit이 다시 열릴 시간까지는 깨어나서 확인해야 합니다. 취소는 notify가 없으므로 더 자주 봅니다.
+                wait_sec = 5.0 if cancel_event is None else CANCEL_CHECK_SEC
+                if deadline is not None:
+                    wait_sec = min(wait_sec, deadline - now)
+                self.condition.wait(max(wait_sec, 0.01))
+
+    def release(self, token: DeeToken, success):
+        """ success가 None이면 (취소된 요청) health와 breaker는 그대로 두고 자리만 돌려받습니다. """
+        with self.condition:
+            token.inflight -= 1
+            token.half_open_trial = False
+            if success:
+                token.successes += 1
+                token.consecutive_failures = 0
+                token.open_until = 0.0
+                token.health += HEALTH_ALPHA * (1.0 - token.health)
+            elif success is not None:
+                token.failures += 1
+                token.consecutive_failures += 1
+                token.health -= HEALTH_ALPHA * token.health
+                if token.consecutive_failures >= self.breaker_threshold:
+                    token.open_until = time.time() + self.breaker_cooldown_sec
+            self.condition.notify_all()
+
+    def to_dict(self):
+        with self.condition:
+            return [token.to_dict() for token in self.tokens]
+
+
+_pool = None
+_pool_tokens = None
+_pool_lock = threading.Lock()
+
+
+def get_dee_tokens() -> list[str]:
+    tokens = parse_token_list(get_config("dee_tokens", []))
+    if not tokens:
+        tokens = parse_token_list(get_config("dee_token", ""))
+    return tokens
+
+
+def get_dee_token_pool() -> DeeTokenPool:
+    """ 프로세스 전체에서 공유하는 토큰 풀을 돌려줍니다. config의 토큰 목록이 바뀌면 새로 만듭니다. """
+    global _pool
+    global _pool_tokens
+    tokens = get_dee_tokens()
+    with _pool_lock:
+        if _pool is None or _pool_tokens != tokens:
+            _pool = DeeTokenPool(
+                tokens,
+                max_inflight=int(get_config("dee_token_max_inflight", 1)),
+                breaker_threshold=int(get_config("dee_breaker_threshold", 3)),
+                breaker_cooldown_sec=float(get_config("dee_breaker_cooldown_sec", 300)))
+            _pool_tokens = tokens
+        return _pool
+
+
+def get_dee_concurrency() -> int:
+    pool = get_dee_token_pool()
+    return max(1, min(int(get_config("dee_max_concurrency", pool.capacity())), pool.capacity()))
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+
+def make_cache_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def link_or_copy(src_path: str, dst_path: str):
+    """ 같은 파일시스템이면 하드링크, 아니면 복사합니다. dst_path는 원자적으로 교체됩니다. """
+    temp_path = f"{dst_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(src_path, temp_path)
+    except OSError:
+        shutil.copyfile(src_path, temp_path)
+    os.replace(temp_path, dst_path)
+
+
+class DiskCache:
+    """
+    키 -> 파일 형태의 디스크 캐시입니다. 파일 mtime을 마지막 사용 시각으로 써서
+    전체 크기가 max_bytes를 넘으면 오래 안 쓴 항목부터 지웁니다.
+    항목마다 선택적으로 메타데이터 JSON을 함께 저장합니다.
+    """
+
+    def __init__(self, root: str, max_bytes: int, ext: str = ""):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ext = ext
+        self.lock = threading.Lock()
+        self.total_bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + self.ext)
+
+    def get_meta_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".json")
+
+    def touch(self, key: str):
+        """ 있으면 (경로, 크기)를 돌려주고 사용 시각을 갱신합니다. 통계에는 넣지 않습니다. """
+        path = self.get_path(key)
+        try:
+            os.utime(path)
+            return path, os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+
+    def record_lookup(self, hit_size=None):
+        with self.lock:
+            if hit_size is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.bytes_saved += hit_size
+
+    def get(self, key: str):
+        """ 캐시된 파일 경로를 돌려주고 사용 시각을 갱신합니다. 없으면 None. """
+        found = self.touch(key)
+        self.record_lookup(found[1] if found else None)
+        return found[0] if found else None
+
+    def get_meta(self, key: str):
+        try:
+            with open(self.get_meta_path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def copy_to(self, key: str, dst_path: str) -> bool:
+        return self.copy_first_to([key], dst_path) is not None
+
+    def copy_first_to(self, keys: list[str], dst_path: str):
+        """ keys 중 처음 찾은 항목을 dst_path로 복사하고 그 키를 돌려줍니다. 키가 여러 개여도 조회 한 번으로 셉니다. """
+        for key in keys:
+            found = self.touch(key)
+            if not found:
+                continue
+            try:
+                link_or_copy(found[0], dst_path)
+            except FileNotFoundError:
+                # 다른 프로세스가 막 지운 경우
+                continue
+            self.record_lookup(found[1])
+            return key
+        self.record_lookup()
+        return None
+
+    def put_file(self, key: str, src_path: str, meta: dict = None):
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if meta is not None:
+            self.write_meta(key, meta)
+        link_or_copy(src_path, path)
+        self.added(os.path.getsize(path))
+
+    def put_bytes(self, key: str, data: bytes, meta: dict = None):
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if meta is not None:
+            self.write_meta(key, meta)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        self.added(len(data))
+
+    def write_meta(self, key: str, meta: dict):
+        meta_path = self.get_meta_path(key)
+        temp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(temp_path, meta_path)
+
+    def remove(self, key: str):
+        for path in (self.get_path(key), self.get_meta_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def scan(self):
+        entries = []
+        if not os.path.exists(self.root):
+            return entries
+        for dir_name in os.listdir(self.root):
+            dir_path = os.path.join(self.root, dir_name)
+            if not os.path.isdir(dir_path):
+                continue
+            for file_name in os.listdir(dir_path):
+                if file_name.endswith(".tmp") or file_name.endswith(".json"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dir_path, file_name))
+                except FileNotFoundError:
+                    continue
+                key = file_name[:len(file_name) - len(self.ext)] if self.ext else file_name
+                entries.append((stat.st_mtime, stat.st_size, key))
+        return entries
+
+    def added(self, size: int):
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(entry[1] for entry in self.scan())
+            else:
+                self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # 여러 프로세스가 같은 캐시를 쓰므로 지울 때는 디스크를 다시 스캔합니다.
+        entries = sorted(self.scan())
+        total = sum(entry[1] for entry in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            self.remove(key)
+            total -= size
+            self.evictions += 1
+        self.total_bytes = total
+        logging.info(f"cache {self.root} evicted to {total} bytes")
+
+    def stats(self):
+        with self.lock:
+            requests_count = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests_count if requests_count else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "evictions": self.evictions,
+                "total_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+            }
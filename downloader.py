@@ -0,0 +1,117 @@
+import logging
+import os
+import time
+
+import ffmpeg
+import requests
+
+from http_session import get_session
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+CONNECT_TIMEOUT_SEC = 10
+READ_TIMEOUT_SEC = 60
+DOWNLOAD_RETRIES = 3
+RETRY_BACKOFF_SEC = 2
+
+
+class DownloadError(Exception):
+    pass
+
+
+class IncompleteDownload(DownloadError):
+    pass
+
+
+def get_part_path(output_path: str) -> str:
+    return output_path + ".part"
+
+
+def verify_video(path: str) -> dict:
+    """ ffprobe로 영상 스트림과 길이를 확인합니다. 확인된 probe 결과를 돌려줍니다. """
+    try:
+        probe = ffmpeg.probe(path)
+    except ffmpeg.Error as e:
+        raise DownloadError(f"ffprobe failed for {path}: {e.stderr.decode('utf-8', 'ignore') if e.stderr else e}")
+    video_streams = [stream for stream in probe.get("streams", []) if stream.get("codec_type") == "video"]
+    if not video_streams:
+        raise DownloadError(f"No video stream in {path}")
+    duration = float(probe.get("format", {}).get("duration") or 0)
+    if duration <= 0:
+        raise DownloadError(f"Invalid duration in {path}")
+    return probe
+
+
+def get_total_size(response: requests.Response, offset: int):
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        if total.isdigit():
+            return int(total)
+    content_length = response.headers.get("Content-Length")
+    if content_length and content_length.isdigit():
+        return offset + int(content_length)
+    return None
+
+
+def download_once(url: str, part_path: str, consumer=None):
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with get_session().get(url, stream=True, headers=headers,
+                           timeout=(CONNECT_TIMEOUT_SEC, READ_TIMEOUT_SEC)) as response:
+        if response.status_code == 416 and offset:
+            # 이미 끝까지 받아둔 경우
+            return
+        if response.status_code == 200:
+            if offset and consumer:
+                # 서버가 Range를 무시했으니 처음부터 다시 받습니다. 이미 흘려보낸 데이터는 쓸 수 없습니다.
+                consumer.abort()
+            offset = 0
+            mode = "wb"
+        elif response.status_code == 206:
+            mode = "ab"
+        else:
+            raise DownloadError(f"Failed to download video from {url}, status code: {response.status_code}")
+
+        total = get_total_size(response, offset)
+        written = offset
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if not chunk:
+                    continue
+                f.write(chunk)
+                written += len(chunk)
+                if consumer:
+                    consumer.write(chunk)
+
+    if total is not None and written != total:
+        raise IncompleteDownload(f"Incomplete download: {written}/{total} bytes")
+
+
+def download_video(url: str, output_path: str, consumer=None, retries: int = DOWNLOAD_RETRIES) -> dict:
+    """
+    url을 output_path.part 로 이어받기(Range) 하면서 내려받고, 크기와 ffprobe 확인 후 output_path로 교체합니다.
+    consumer(write/abort)를 넘기면 받은 바이트를 그대로 흘려보냅니다.
+    :return: ffprobe 결과
+    """
+    part_path = get_part_path(output_path)
+    last_error = None
+    for attempt in range(retries + 1):
+        try:
+            download_once(url, part_path, consumer)
+            probe = verify_video(part_path)
+            os.replace(part_path, output_path)
+            return probe
+        except (IncompleteDownload, requests.RequestException) as e:
+            # 끊긴 지점부터 이어받습니다.
+            last_error = e
+        except DownloadError as e:
+            # 내용이 잘못된 파일은 이어받아도 소용없으므로 지웁니다.
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            if consumer:
+                consumer.abort()
+            last_error = e
+        logging.warning(f"download {url} attempt {attempt + 1} failed: {last_error}")
+        if attempt < retries:
+            time.sleep(RETRY_BACKOFF_SEC * (attempt + 1))
+    raise last_error
@@ -0,0 +1,67 @@
+import json
+from dataclasses import dataclass, fields
+
+from config import get_config
+
+ENCODING_PROFILE_DEFAULT = "default"
+ENCODING_PROFILE_DRAFT = "draft"
+
+# config의 "encoding_profiles"에 같은 이름이 있으면 그 값으로 덮어씁니다.
+DEFAULT_ENCODING_PROFILES = {
+    ENCODING_PROFILE_DEFAULT: {"preset": "medium", "crf": 23},
+    "fast": {"preset": "veryfast", "crf": 23},
+    "high": {"preset": "slow", "crf": 20},
+    ENCODING_PROFILE_DRAFT: {"preset": "ultrafast", "crf": 32, "height": 360, "tune": "fastdecode"},
+}
+
+
+@dataclass
+class EncodingProfile:
+    preset: str = "medium"
+    crf: int = 23
+    threads: int = 0
+    # 0이면 원본 해상도를 유지합니다.
+    height: int = 0
+    tune: str = ""
+
+    def to_ffmpeg_args(self) -> dict:
+        args = {"vcodec": "libx264", "acodec": "aac", "preset": self.preset, "crf": self.crf}
+        if self.threads:
+            args["threads"] = self.threads
+        if self.tune:
+            args["tune"] = self.tune
+        return args
+
+    def to_moviepy_ffmpeg_params(self) -> list[str]:
+        params = ["-crf", str(self.crf)]
+        if self.tune:
+            params += ["-tune", self.tune]
+        return params
+
+    def scale(self, video):
+        """ ffmpeg-python 스트림에 해상도 조절을 붙입니다. 너비는 짝수로 맞춥니다. """
+        if self.height:
+            return video.filter("scale", -2, self.height)
+        return video
+
+
+def get_configured_profiles() -> dict:
+    """ /api/config 로 저장하면 JSON 문자열이 됩니다. 이름 -> 설정 dict 형태가 아니면 ValueError를 던집니다. """
+    value = get_config("encoding_profiles", {})
+    if isinstance(value, str):
+        try:
+            value = json.loads(value) if value.strip() else {}
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid encoding_profiles config: {e}")
+    if not isinstance(value, dict) or not all(isinstance(profile, dict) for profile in value.values()):
+        raise ValueError("Invalid encoding_profiles config: expected an object of objects")
+    return value
+
+
+def get_encoding_profile(name: str) -> EncodingProfile:
+    profiles = dict(DEFAULT_ENCODING_PROFILES)
+    profiles.update(get_configured_profiles())
+    if name not in profiles:
+        raise ValueError(f"Unknown encoding profile: {name}")
+    known_fields = {field.name for field in fields(EncodingProfile)}
+    return EncodingProfile(**{key: value for key, value in profiles[name].items() if key in known_fields})
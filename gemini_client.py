@@ -1,7 +1,11 @@
 import os
+import threading
 from dotenv import load_dotenv
 from google import genai
 
+from metrics import observe_call
+from script_cache import get_cached_script, get_script_cache_key, put_cached_script
+
 # .env 파일에서 환경 변수를 로드합니다.
 load_dotenv()
 
@@ -12,9 +16,25 @@ PROMPT = """
 가게 분위기: <mode>
 """
 
+GEMINI_MODEL = 'gemini-2.5-flash'
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_genai_client(api_key: str) -> genai.Client:
+    """ 프로세스 전체에서 API 키마다 하나의 genai.Client를 공유합니다. """
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = genai.Client(api_key=api_key)
+            _clients[api_key] = client
+        return client
+
+
 class GeminiClient:
 
-    def __init__(self):
+    def __init__(self, model_name: str = GEMINI_MODEL):
         """
         GeminiClient를 초기화하고 API 키 설정 및 모델을 준비합니다.
         """
@@ -23,16 +43,66 @@ class GeminiClient:
         if not api_key:
             raise ValueError("GEMINI_API_KEY 환경 변수가 설정되지 않았습니다.")
 
-        # 2. google-genai 라이브러리에 API 키를 설정합니다.
-        self.model = genai.Client(api_key=api_key)
+        # 2. 같은 키를 쓰는 GeminiClient들은 하나의 클라이언트를 공유합니다.
+        self.model = get_genai_client(api_key)
+        self.model_name = model_name
 
-    def generate_script(self, business_name: str, description: str, mode: str) -> str:
+    def build_prompt(self, business_name: str, description: str, mode: str) -> str:
         prompt = PROMPT.replace("<business_name>", business_name)
         prompt = prompt.replace("<description>", description)
         prompt = prompt.replace("<mode>", mode)
-        response = self.model.models.generate_content(
-            model='gemini-2.5-flash', contents=[prompt])
-        return response.text
+        return prompt
+
+    def generate_script(self, business_name: str, description: str, mode: str, regenerate: bool = False) -> str:
+        """
+        같은 프롬프트 / 모델로 만든 대본이 캐시에 있으면 그대로 돌려줍니다.
+        :param regenerate: True면 캐시를 무시하고 새로 생성해서 캐시를 덮어씁니다.
+        """
+        prompt = self.build_prompt(business_name, description, mode)
+        cache_key = get_script_cache_key(prompt, self.model_name)
+        if not regenerate:
+            script = get_cached_script(cache_key)
+            if script is not None:
+                return script
+
+        with observe_call("gemini", "generate"):
+            response = self.model.models.generate_content(
+                model=self.model_name, contents=[prompt])
+        script = response.text
+        if script:
+            put_cached_script(cache_key, script, self.model_name)
+        return script
+
+    def stream_script_lines(self, business_name: str, description: str, mode: str, regenerate: bool = False):
+        """
+        스트리밍 API로 대본을 받으면서 줄이 완성될 때마다 바로 yield 합니다.
+        캐시에 있으면 캐시된 대본의 줄들을 돌려주고, 끝까지 받은 대본은 캐시에 저장합니다.
+        """
+        prompt = self.build_prompt(business_name, description, mode)
+        cache_key = get_script_cache_key(prompt, self.model_name)
+        if not regenerate:
+            script = get_cached_script(cache_key)
+            if script is not None:
+                yield from script.split('\n')
+                return
+
+        chunks = []
+        buffer = ""
+        # 스트림이 끝날 때까지의 시간을 잽니다.
+        with observe_call("gemini", "generate_stream"):
+            for chunk in self.model.models.generate_content_stream(model=self.model_name, contents=[prompt]):
+                if not chunk.text:
+                    continue
+                chunks.append(chunk.text)
+                buffer += chunk.text
+                *lines, buffer = buffer.split('\n')
+                yield from lines
+        if buffer:
+            yield buffer
+
+        script = "".join(chunks)
+        if script:
+            put_cached_script(cache_key, script, self.model_name)
 
 
 if __name__ == '__main__':
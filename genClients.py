@@ -1,66 +1,180 @@
-import time
+import asyncio
+import logging
 import os
+import random
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+from collections import deque
+from google.genai import errors as genai_errors
 from google.genai.types import Image
 from google import genai
 
 #VIDEO_MODEL_NAME = "veo-3.0-fast-generate-preview"
 VIDEO_MODEL_NAME = "veo-2.0-generate-001"
+VEO_RESOLUTION = "720p"
+VEO_LENGTH_SEC = 8
 RETRY_COUNT = 3
 
+# 키 하나에서 동시에 진행할 생성 수와 분당 제출 수
+VEO_KEY_MAX_INFLIGHT = int(os.getenv("VEO_KEY_MAX_INFLIGHT", "2"))
+VEO_KEY_RPM = int(os.getenv("VEO_KEY_RPM", "10"))
+# 할당량 초과(429)를 받은 키는 이 시간 동안 쓰지 않습니다.
+VEO_KEY_COOLDOWN_SEC = float(os.getenv("VEO_KEY_COOLDOWN_SEC", "60"))
+POLL_INITIAL_SEC = 20.0
+POLL_INTERVAL_SEC = 10.0
+POLL_JITTER = 0.2
+KEY_WAIT_SEC = 1.0
+
 # Load API keys from environment variable
 api_keys_str = os.getenv('GENAI_API_KEY', '')
 api_keys = [key.strip() for key in api_keys_str.split(',') if key.strip()]
 
 # Initialize genai clients
 genai_clients = [genai.Client(api_key=api_key) for api_key in api_keys]
-current_client_index = 0
-client_lock = threading.Lock()  # Lock for thread-safe client rotation
-
-def get_current_genai_client():
-    """Returns the current genai client based on current_client_index"""
-    if not genai_clients:
-        raise ValueError("No genai clients available")
-    with client_lock:
-        return genai_clients[current_client_index]
-
-def rotate_genai_client():
-    """Rotates to the next genai client, wrapping around to the beginning if needed"""
-    global current_client_index
-    if not genai_clients:
-        raise ValueError("No genai clients available")
-    with client_lock:
-        current_client_index = (current_client_index + 1) % len(genai_clients)
-        return genai_clients[current_client_index]
+
+
+class VeoKey:
+    def __init__(self, index: int, client: genai.Client):
+        self.index = index
+        self.client = client
+        self.inflight = 0
+        self.submitted_at = deque()
+        self.cooldown_until = 0.0
+        self.successes = 0
+        self.failures = 0
+
+    def can_submit(self, now: float) -> bool:
+        while self.submitted_at and self.submitted_at[0] < now - 60:
+            self.submitted_at.popleft()
+        return (self.inflight < VEO_KEY_MAX_INFLIGHT
+                and len(self.submitted_at) < VEO_KEY_RPM
+                and self.cooldown_until <= now)
+
+    def to_dict(self):
+        return {
+            "key": self.index,
+            "inflight": self.inflight,
+            "submitted_last_minute": len(self.submitted_at),
+            "cooling_down": self.cooldown_until > time.time(),
+            "successes": self.successes,
+            "failures": self.failures,
+        }
+
+
+class VeoEngine:
+    """
+    하나의 이벤트 루프 스레드에서 여러 Veo 생성 작업을 함께 진행합니다.
+    작업마다 스레드를 재우지 않고 operation 조회를 jitter를 둔 비동기 sleep으로 나눠서 합니다.
+    키마다 동시 진행 수 / 분당 제출 수를 세고, 실패한 작업은 그 작업만 다른 키로 다시 시도합니다.
+    """
+
+    def __init__(self, clients: list[genai.Client]):
+        self.keys = [VeoKey(index, client) for index, client in enumerate(clients)]
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="veo-engine", daemon=True)
+        self.thread.start()
+
+    def submit(self, input_image_path: str, prompt: str, output_video_path: str):
+        """ 어느 스레드에서나 호출할 수 있습니다. concurrent.futures.Future를 돌려줍니다. """
+        return asyncio.run_coroutine_threadsafe(
+            self.generate(input_image_path, prompt, output_video_path), self.loop)
+
+    def pick_key(self, exclude: set):
+        now = time.time()
+        candidates = [key for key in self.keys if key.index not in exclude and key.can_submit(now)]
+        if not candidates:
+            # 모든 키가 한 번씩 실패했으면 다시 처음부터 후보로 둡니다.
+            candidates = [key for key in self.keys if key.can_submit(now)] if len(exclude) >= len(self.keys) else []
+        if not candidates:
+            return None
+        return min(candidates, key=lambda key: (key.inflight, len(key.submitted_at)))
+
+    async def acquire_key(self, exclude: set) -> VeoKey:
+        # 루프 스레드 하나에서만 바꾸므로 lock이 필요 없습니다.
+        while True:
+            key = self.pick_key(exclude)
+            if key:
+                key.inflight += 1
+                key.submitted_at.append(time.time())
+                return key
+            await asyncio.sleep(KEY_WAIT_SEC)
+
+    async def generate(self, input_image_path: str, prompt: str, output_video_path: str):
+        if not self.keys:
+            raise ValueError("No genai clients available")
+        failed_keys = set()
+        last_error = None
+        for attempt in range(RETRY_COUNT):
+            key = await self.acquire_key(failed_keys)
+            try:
+                await self.generate_with_key(key, input_image_path, prompt, output_video_path)
+                key.successes += 1
+                return
+            except Exception as e:
+                logging.warning(f"generate_video: {output_video_path} key {key.index} attempt {attempt + 1}: {e}")
+                key.failures += 1
+                failed_keys.add(key.index)
+                if isinstance(e, genai_errors.APIError) and e.code == 429:
+                    key.cooldown_until = time.time() + VEO_KEY_COOLDOWN_SEC
+                last_error = e
+            finally:
+                key.inflight -= 1
+        raise last_error
+
+    async def generate_with_key(self, key: VeoKey, input_image_path: str, prompt: str, output_video_path: str):
+        client = key.client
+        image = await asyncio.to_thread(Image.from_file, location=input_image_path)
+        operation = await client.aio.models.generate_videos(
+            model=VIDEO_MODEL_NAME,
+            prompt=prompt,
+            image=image)
+
+        started_at = time.time()
+        delay = POLL_INITIAL_SEC
+        while not operation.done:
+            # 같은 시각에 제출된 작업들이 한꺼번에 조회하지 않도록 간격을 흩뜨립니다.
+            await asyncio.sleep(delay * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER))
+            delay = POLL_INTERVAL_SEC
+            operation = await client.aio.operations.get(operation)
+            logging.info(f"generate_video: {output_video_path} elapsed time: {time.time() - started_at:.0f}s")
+
+        if operation.error:
+            raise Exception(f"generate_video: {operation.error}")
+        video = operation.response.generated_videos[0]
+        data = await client.aio.files.download(file=video.video)
+        await asyncio.to_thread(write_file, output_video_path, data)
+        logging.info(f"saved video: {output_video_path}")
+
+    def to_dict(self):
+        return [key.to_dict() for key in self.keys]
+
+
+def write_file(path: str, data: bytes):
+    # 같은 경로를 동시에 쓰는 요청끼리 임시 파일이 겹치지 않도록 프로세스 / 스레드 id를 붙입니다.
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_veo_engine() -> VeoEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = VeoEngine(genai_clients)
+        return _engine
+
+
+def get_veo_engine_if_started():
+    """ 상태 조회용입니다. 아직 만들어지지 않았으면 이벤트 루프 스레드를 띄우지 않고 None을 돌려줍니다. """
+    with _engine_lock:
+        return _engine
+
 
 def gen_video(input_image_path: str, prompt: str, output_video_path: str):
-    for i in range(RETRY_COUNT):
-        try:
-            inner_gen_video(input_image_path, prompt, output_video_path)
-            return
-        except Exception as e:
-            print(e)
-            rotate_genai_client()
-            last_error = e
-    raise last_error
-
-def inner_gen_video(input_image_path: str, prompt: str, output_video_path: str):
-    client = get_current_genai_client()
-    image = Image.from_file(location=input_image_path)
-    operation = client.models.generate_videos(
-        model=VIDEO_MODEL_NAME,
-        prompt=prompt,
-        image=image)
-        
-    elapsed_time = 0
-    while not operation.done:
-        print(f"generate_video: {output_video_path} elapsed time: {elapsed_time}s")
-        time.sleep(10)
-        elapsed_time += 10
-        operation = client.operations.get(operation)
-
-    video = operation.response.generated_videos[0]
-    client.files.download(file=video.video)
-    video.video.save(output_video_path)
-    print(f"saved video: {output_video_path}")
\ No newline at end of file
+    """ 기존 동기 API입니다. 생성은 공유 이벤트 루프에서 진행되고 호출한 스레드는 결과만 기다립니다. """
+    get_veo_engine().submit(input_image_path, prompt, output_video_path).result()
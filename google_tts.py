@@ -1,31 +1,115 @@
+import html
 import os
+import threading
+from google.api_core import exceptions as google_exceptions
+from google.api_core.retry import Retry, if_exception_type
 from google.cloud import texttospeech
+from google.cloud import texttospeech_v1beta1
+from mutagen.mp3 import MP3
+
+from metrics import observe_call
+from tts_cache import get_tts_cache_key, tts_cache
+
+DEFAULT_CREDENTIALS_PATH = "google-service-key.json"
+
+# 할당량 초과 / 일시적인 서버 오류는 지수 백오프로 다시 시도합니다.
+TTS_RETRY = Retry(
+    predicate=if_exception_type(
+        google_exceptions.ResourceExhausted,
+        google_exceptions.TooManyRequests,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.DeadlineExceeded),
+    initial=1.0,
+    maximum=20.0,
+    multiplier=2.0,
+    timeout=120.0)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_tts_client(credentials_path=DEFAULT_CREDENTIALS_PATH) -> texttospeech.TextToSpeechClient:
+    """
+    프로세스 전체에서 공유하는 TextToSpeechClient를 돌려줍니다. gRPC 클라이언트는 스레드 간에 공유해도 안전합니다.
+    서비스 계정 키 파일이 있으면 환경 변수를 건드리지 않고 그 키로 만듭니다.
+    """
+    with _clients_lock:
+        client = _clients.get(credentials_path)
+        if client is None:
+            if credentials_path and os.path.exists(credentials_path):
+                client = texttospeech.TextToSpeechClient.from_service_account_file(credentials_path)
+            else:
+                client = texttospeech.TextToSpeechClient()
+            _clients[credentials_path] = client
+        return client
+
+
+_beta_clients = {}
+
+
+def get_tts_beta_client(credentials_path=DEFAULT_CREDENTIALS_PATH) -> texttospeech_v1beta1.TextToSpeechClient:
+    """ SSML mark 타임포인트는 v1beta1 API에만 있습니다. """
+    with _clients_lock:
+        client = _beta_clients.get(credentials_path)
+        if client is None:
+            if credentials_path and os.path.exists(credentials_path):
+                client = texttospeech_v1beta1.TextToSpeechClient.from_service_account_file(credentials_path)
+            else:
+                client = texttospeech_v1beta1.TextToSpeechClient()
+            _beta_clients[credentials_path] = client
+        return client
+
+
+def build_marked_ssml(lines: list[str]):
+    """
+    단어마다 뒤에 <mark>를 붙인 SSML을 만듭니다.
+    :return: (ssml, mark 이름 순서대로의 단어 목록)
+    """
+    words = []
+    parts = ["<speak>"]
+    for line in lines:
+        parts.append("<s>")
+        for word in line.split():
+            parts.append(f'{html.escape(word)} <mark name="w{len(words)}"/>')
+            words.append(word)
+        parts.append("</s>")
+    parts.append("</speak>")
+    return " ".join(parts), words
 
 
 class GoogleTTS:
-    def __init__(self, credentials_path="google-service-key.json"):
+    def __init__(self, credentials_path=DEFAULT_CREDENTIALS_PATH):
         """
         GoogleTTS 클래스를 초기화합니다.
-        GOOGLE_APPLICATION_CREDENTIALS 환경 변수를 설정합니다.
+        같은 키 파일을 쓰는 GoogleTTS들은 하나의 클라이언트를 공유합니다.
 
         :param credentials_path: Google Cloud 서비스 계정 키 파일 경로
         """
         # TODO: "YOUR_SERVICE_ACCOUNT_KEY.json"을 실제 서비스 계정 키 파일 경로로 바꾸세요.
         # 이 파일은 Google Cloud Console에서 다운로드할 수 있습니다.
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
-        self.client = texttospeech.TextToSpeechClient()
+        self.credentials_path = credentials_path
+        self.client = get_tts_client(credentials_path)
 
     def synthesize_speech(self, text, output_filename, language_code, voice_name, speaking_rate=1.0):
         """
         주어진 텍스트를 음성으로 변환하고 파일로 저장합니다.
+        같은 텍스트 / 언어 / 목소리 / 속도로 만든 적이 있으면 디스크 캐시에서 가져옵니다.
 
         :param text: 음성으로 변환할 텍스트
         :param output_filename: 저장할 오디오 파일 이름 (기본값: "output.mp3")
         :param language_code: 사용할 언어 코드 (기본값: "ko-KR")
         :param voice_name: 사용할 목소리 이름 (기본값: "ko-KR-Neural2-A")
         :param speaking_rate: 말하기 속도 (0.25 ~ 4.0, 기본값: 1.0)
-        :return: 성공 시 True, 실패 시 False
+        :return: 오디오 길이(초)
         """
+        audio_encoding = texttospeech.AudioEncoding.MP3
+        cache_key = get_tts_cache_key(text, language_code, voice_name, speaking_rate, audio_encoding.name)
+        if tts_cache.copy_to(cache_key, output_filename):
+            meta = tts_cache.get_meta(cache_key)
+            if meta and "duration" in meta:
+                return meta["duration"]
+            return MP3(output_filename).info.length
+
         synthesis_input = texttospeech.SynthesisInput(text=text)
 
         voice = texttospeech.VoiceSelectionParams(
@@ -34,16 +118,58 @@ class GoogleTTS:
         )
 
         audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3,
+            audio_encoding=audio_encoding,
             speaking_rate=speaking_rate
         )
-        response = self.client.synthesize_speech(
-            input=synthesis_input, voice=voice, audio_config=audio_config
-        )
+        with observe_call("google_tts", "synthesize"):
+            response = self.client.synthesize_speech(
+                input=synthesis_input, voice=voice, audio_config=audio_config, retry=TTS_RETRY
+            )
+
+        # output_filename이 캐시 파일과 하드링크로 이어져 있을 수 있으므로 덮어쓰지 않고 교체합니다.
+        temp_filename = output_filename + ".tmp"
+        with open(temp_filename, "wb") as out:
+            out.write(response.audio_content)
+        os.replace(temp_filename, output_filename)
+
+        duration = MP3(output_filename).info.length
+        tts_cache.put_file(cache_key, output_filename, meta={"duration": duration})
+        return duration
+
+    def synthesize_ssml_with_marks(self, lines: list[str], output_filename, language_code, voice_name,
+                                   speaking_rate=1.0):
+        """
+        대본 전체를 SSML 요청 하나로 합성하고, 단어마다 넣은 mark의 시각으로 자막 타이밍을 구합니다.
+        mark를 지원하는 목소리(예: Neural2, WaveNet)를 써야 합니다.
+
+        :param lines: 대본 줄 목록
+        :return: [(단어, 끝 시간)] - 단어 뒤 mark가 읽힌 시각이 그 단어의 끝 시간입니다.
+        """
+        ssml, words = build_marked_ssml(lines)
+        client = get_tts_beta_client(self.credentials_path)
+        with observe_call("google_tts", "synthesize_ssml"):
+            response = client.synthesize_speech(
+                request=texttospeech_v1beta1.SynthesizeSpeechRequest(
+                    input=texttospeech_v1beta1.SynthesisInput(ssml=ssml),
+                    voice=texttospeech_v1beta1.VoiceSelectionParams(language_code=language_code, name=voice_name),
+                    audio_config=texttospeech_v1beta1.AudioConfig(
+                        audio_encoding=texttospeech_v1beta1.AudioEncoding.MP3,
+                        speaking_rate=speaking_rate),
+                    enable_time_pointing=[texttospeech_v1beta1.SynthesizeSpeechRequest.TimepointType.SSML_MARK]),
+                retry=TTS_RETRY)
 
         with open(output_filename, "wb") as out:
             out.write(response.audio_content)
 
+        mark_times = {timepoint.mark_name: timepoint.time_seconds for timepoint in response.timepoints}
+        timestamps = []
+        for index, word in enumerate(words):
+            end_time = mark_times.get(f"w{index}")
+            if end_time is None:
+                raise Exception(f"Missing timepoint for mark w{index} ({voice_name} may not support SSML marks)")
+            timestamps.append((word, end_time))
+        return timestamps
+
 
 # 예제 사용법
 if __name__ == '__main__':
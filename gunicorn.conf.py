@@ -0,0 +1,19 @@
+import os
+import shutil
+
+# Dockerfile의 CMD 옵션과 함께 gunicorn이 시작할 때 읽습니다.
+
+
+def on_starting(server):
+    # 지난 실행에서 남은 워커별 metric 파일을 지웁니다.
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # 종료된 워커의 gauge 값이 /metrics에 남지 않도록 합니다.
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
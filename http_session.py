@@ -0,0 +1,45 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_POOL_SIZE = 32
+RETRY_STATUS_LIST = (429, 500, 502, 503, 504)
+# requests에는 기본 timeout이 없어서 응답이 멈추면 영원히 기다립니다. 호출마다 timeout=으로 넘깁니다.
+CONNECT_TIMEOUT_SEC = 10
+READ_TIMEOUT_SEC = 30
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT_SEC, READ_TIMEOUT_SEC)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_session(pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    """
+    keep-alive 연결을 재사용하는 세션을 만듭니다.
+    429/5xx 재시도는 GET 같은 멱등 요청에만 적용하고, POST는 연결 자체가 실패한 경우에만 다시 보냅니다.
+    (submit이 두 번 처리되면 생성 비용을 두 번 내게 됩니다.)
+    """
+    retry = Retry(
+        total=3,
+        connect=3,
+        backoff_factor=0.5,
+        status_forcelist=RETRY_STATUS_LIST,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """ 프로세스 전체에서 공유하는 세션입니다. requests.Session은 요청 전송에 대해 스레드 간 공유가 가능합니다. """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
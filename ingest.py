@@ -0,0 +1,92 @@
+import hashlib
+import io
+import os
+
+from PIL import Image
+
+from task import ImageInfo
+
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+CHUNK_SIZE = 1024 * 1024
+# 대부분의 JPEG/PNG/WebP는 이 안에 크기 정보가 들어 있습니다. EXIF가 더 크면 파일에서 다시 읽습니다.
+HEADER_BYTES = 256 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def read_image_header(source) -> tuple[int, int, str]:
+    """ PIL은 open 시 헤더만 읽고 픽셀은 디코딩하지 않습니다. """
+    with Image.open(source) as img:
+        # 휴대폰 사진은 MPO(여러 장이 붙은 JPEG)로 열리는 경우가 있습니다.
+        image_format = "JPEG" if img.format == "MPO" else img.format
+        mime_type = Image.MIME.get(image_format)
+        if not mime_type:
+            raise InvalidImage(f"Unsupported image format: {img.format}")
+        width, height = img.size
+        return width, height, mime_type
+
+
+def ingest_image(stream, output_path: str, max_bytes: int = MAX_IMAGE_BYTES, uploaded_bytes: int = 0,
+                 max_upload_bytes: int = MAX_UPLOAD_BYTES) -> ImageInfo:
+    """
+    업로드 스트림을 청크 단위로 output_path에 쓰면서 같은 패스에서 SHA-256을 계산하고,
+    앞부분 바이트로 이미지 크기와 MIME 타입을 읽습니다. 실패하면 쓰던 파일을 지웁니다.
+    :param uploaded_bytes: 같은 요청에서 앞서 받은 이미지 크기의 합. max_upload_bytes와 함께 요청 전체 크기를 제한합니다.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    head = bytearray()
+    try:
+        with open(output_path, "wb") as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Image is larger than {max_bytes} bytes")
+                if uploaded_bytes + size > max_upload_bytes:
+                    raise UploadTooLarge(f"Upload is larger than {max_upload_bytes} bytes")
+                hasher.update(chunk)
+                if len(head) < HEADER_BYTES:
+                    head.extend(chunk[:HEADER_BYTES - len(head)])
+                f.write(chunk)
+
+        if size == 0:
+            raise InvalidImage("Empty image")
+        try:
+            width, height, mime_type = read_image_header(io.BytesIO(bytes(head)))
+        except InvalidImage:
+            raise
+        except Exception:
+            try:
+                width, height, mime_type = read_image_header(output_path)
+            except InvalidImage:
+                raise
+            except Exception as e:
+                raise InvalidImage(f"Not an image: {e}")
+    except Exception:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+    return ImageInfo(
+        sha256=hasher.hexdigest(),
+        size=size,
+        width=width,
+        height=height,
+        mime_type=mime_type)
+
+
+def get_image_ext(filename: str, mime_type: str) -> str:
+    ext = os.path.splitext(filename or "")[1]
+    if ext:
+        return ext.lower()
+    return "." + mime_type.split("/")[-1].replace("jpeg", "jpg")
@@ -0,0 +1,103 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from task import VideoTask, TASK_STATUS_QUEUED, TASK_STATUS_RUNNING
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# 다른 프로세스가 잡고 있던 task가 그 프로세스가 죽은 뒤에도 남지 않도록 주기적으로 다시 확인합니다.
+JOB_RECOVER_INTERVAL_SEC = float(os.environ.get("JOB_RECOVER_INTERVAL_SEC", "60"))
+LOCK_FILE_NAME = "run.lock"
+
+
+class TaskLock:
+    """
+    task 디렉토리의 run.lock 파일에 대한 프로세스 간 배타 락입니다.
+    gunicorn worker 여러 개가 같은 task를 동시에 실행하지 않도록 막습니다.
+    프로세스가 죽으면 OS가 락을 풀어주므로 재시작 후 다시 잡을 수 있습니다.
+    """
+
+    def __init__(self, task_id: str):
+        self.path = os.path.join(VideoTask(task_id).get_work_dir(), LOCK_FILE_NAME)
+        self.file = None
+
+    def acquire(self) -> bool:
+        self.file = open(self.path, "a")
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            self.file.close()
+            self.file = None
+            return False
+
+    def release(self):
+        if self.file:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+
+class JobRunner:
+    def __init__(self, max_workers: int = JOB_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def submit(self, task_id: str) -> bool:
+        with self.lock:
+            if task_id in self.pending:
+                return False
+            self.pending.add(task_id)
+        self.executor.submit(self.run_task, task_id)
+        return True
+
+    def run_task(self, task_id: str):
+        task_lock = TaskLock(task_id)
+        try:
+            if not task_lock.acquire():
+                # 그 프로세스가 락을 쥔 채 죽으면 다음 recovery sweep에서 다시 넣습니다.
+                logging.info(f"task {task_id} is running in another process")
+                return
+            try:
+                # 큐에서 기다리는 동안 다른 프로세스가 끝냈거나 실패 / 승인 대기로 바뀌었을 수 있으므로 락을 잡은 뒤 다시 읽습니다.
+                task = VideoTask.resume_from(task_id)
+                if task.is_finished() or task.status not in (TASK_STATUS_QUEUED, TASK_STATUS_RUNNING):
+                    logging.info(f"skip task {task_id} ({task.status})")
+                    return
+                logging.info(f"start {task_id}")
+                task.run()
+            finally:
+                task_lock.release()
+        except Exception:
+            logging.exception(f"job {task_id}")
+        finally:
+            with self.lock:
+                self.pending.discard(task_id)
+
+    def recover(self):
+        """ 재시작 전에 끝나지 않은 task들을 다시 큐에 넣습니다. """
+        task_dicts, _ = VideoTask.query_index(
+            status_list=[TASK_STATUS_QUEUED, TASK_STATUS_RUNNING], descending=False)
+        for task_dict in task_dicts:
+            logging.info(f"re-enqueue task {task_dict['task_id']} "
+                         f"({task_dict['status']}, {task_dict['completed_work_list']})")
+            self.submit(task_dict["task_id"])
+        return len(task_dicts)
+
+    def start_recovery(self, interval_sec: float = JOB_RECOVER_INTERVAL_SEC):
+        """ 지금 한 번 recover하고, 이후 interval_sec마다 다시 합니다. """
+        self.recover()
+        thread = threading.Thread(target=self.recovery_loop, args=(interval_sec,), name="job-recovery", daemon=True)
+        thread.start()
+
+    def recovery_loop(self, interval_sec: float):
+        while True:
+            time.sleep(interval_sec)
+            try:
+                self.recover()
+            except Exception:
+                logging.exception("job recovery")
@@ -0,0 +1,79 @@
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Gauge, Histogram, REGISTRY, generate_latest, \
+    multiprocess
+
+# gunicorn 워커가 여러 개라서 PROMETHEUS_MULTIPROC_DIR에 워커별 값을 쓰고 /metrics에서 합칩니다.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+
+STAGE_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+CALL_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGE_DURATION = Histogram(
+    "pysv_stage_duration_seconds", "Time spent in one run of a task stage",
+    ["stage", "result"], buckets=STAGE_BUCKETS)
+STAGE_INFLIGHT = Gauge(
+    "pysv_stage_inflight", "Task stages running now",
+    ["stage"], multiprocess_mode="livesum")
+CALL_DURATION = Histogram(
+    "pysv_provider_call_duration_seconds", "Latency of calls to external providers",
+    ["provider", "call", "result"], buckets=CALL_BUCKETS)
+CALL_INFLIGHT = Gauge(
+    "pysv_provider_call_inflight", "Calls to external providers waiting for a response",
+    ["provider", "call"], multiprocess_mode="livesum")
+RENDER_DURATION = Histogram(
+    "pysv_render_duration_seconds", "Time spent in one ffmpeg / MoviePy run (cut, merge, preview or final render)",
+    ["stage", "backend", "preset", "result"], buckets=STAGE_BUCKETS)
+
+
+@contextmanager
+def observe(histogram: Histogram, gauge: Gauge = None, **labels):
+    """ 블록 실행 시간을 result=ok/error 라벨과 함께 기록하고, 실행 중에는 gauge를 1 올려둡니다. """
+    inflight = gauge.labels(**labels) if gauge else None
+    if inflight:
+        inflight.inc()
+    started_at = time.time()
+    result = "error"
+    try:
+        yield
+        result = "ok"
+    finally:
+        histogram.labels(result=result, **labels).observe(time.time() - started_at)
+        if inflight:
+            inflight.dec()
+
+
+def observe_stage(stage: str):
+    return observe(STAGE_DURATION, STAGE_INFLIGHT, stage=stage)
+
+
+def observe_call(provider: str, call: str):
+    return observe(CALL_DURATION, CALL_INFLIGHT, provider=provider, call=call)
+
+
+def observe_render(stage: str, backend: str, preset: str):
+    return observe(RENDER_DURATION, stage=stage, backend=backend, preset=preset)
+
+
+def timed_call(provider: str, call: str):
+    """ observe_call을 함수 전체에 씌우는 데코레이터입니다. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with observe_call(provider, call):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_metrics():
+    """ :return: (본문, Content-Type) """
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,35 @@
+import os
+import time
+
+from disk_cache import DiskCache, make_cache_key
+
+DATA_PATH = os.environ.get("DATA_PATH", "")
+SCRIPT_CACHE_PATH = os.environ.get("SCRIPT_CACHE_PATH", "") or os.path.join(DATA_PATH, "_cache", "scripts")
+SCRIPT_CACHE_MAX_BYTES = int(os.environ.get("SCRIPT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# 같은 프롬프트라도 이 시간이 지나면 새로 생성합니다.
+SCRIPT_CACHE_TTL_SEC = int(os.environ.get("SCRIPT_CACHE_TTL_SEC", str(7 * 24 * 60 * 60)))
+
+script_cache = DiskCache(SCRIPT_CACHE_PATH, SCRIPT_CACHE_MAX_BYTES, ".txt")
+
+
+def get_script_cache_key(prompt: str, model_name: str) -> str:
+    return make_cache_key("script", prompt, model_name)
+
+
+def get_cached_script(key: str):
+    """ TTL 안에 만든 대본이 있으면 돌려줍니다. 없거나 만료됐으면 None. """
+    meta = script_cache.get_meta(key)
+    if not meta or time.time() - meta.get("created_at", 0) > SCRIPT_CACHE_TTL_SEC:
+        return None
+    path = script_cache.get(key)
+    if not path:
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def put_cached_script(key: str, script: str, model_name: str):
+    script_cache.put_bytes(key, script.encode("utf-8"), meta={"created_at": time.time(), "model": model_name})
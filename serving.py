@@ -0,0 +1,52 @@
+import mimetypes
+import os
+
+from flask import Response, request, send_file
+
+DATA_PATH = os.environ.get("DATA_PATH", "")
+
+SENDFILE_MODE_X_ACCEL = "x-accel"
+SENDFILE_MODE_X_SENDFILE = "x-sendfile"
+# 앞단 프록시에 파일 전송을 넘길 때 사용합니다. 비워두면 Flask가 직접 보냅니다.
+SENDFILE_MODE = os.environ.get("SENDFILE_MODE", "")
+# nginx internal location 이름 (예: /protected/ -> alias DATA_PATH)
+X_ACCEL_PREFIX = os.environ.get("X_ACCEL_PREFIX", "/protected/")
+
+
+def get_strong_etag(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def send_task_file(path: str, mimetype: str = None, max_age: int = None, immutable: bool = False,
+                   etag: str = None):
+    """
+    task 디렉토리 안의 파일을 강한 ETag와 함께 보냅니다.
+    Range / If-Range / If-None-Match 는 werkzeug가 처리하고, SENDFILE_MODE가 설정되어 있으면 프록시에 넘깁니다.
+    """
+    if etag is None:
+        etag = get_strong_etag(path)
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    if SENDFILE_MODE in (SENDFILE_MODE_X_ACCEL, SENDFILE_MODE_X_SENDFILE):
+        response = Response(mimetype=mimetype)
+        response.set_etag(etag)
+        if etag in request.if_none_match:
+            response.status_code = 304
+        elif SENDFILE_MODE == SENDFILE_MODE_X_ACCEL:
+            relative_path = os.path.relpath(os.path.abspath(path), os.path.abspath(DATA_PATH))
+            response.headers["X-Accel-Redirect"] = X_ACCEL_PREFIX.rstrip("/") + "/" + relative_path.replace(os.sep, "/")
+        else:
+            response.headers["X-Sendfile"] = os.path.abspath(path)
+    else:
+        response = send_file(path, mimetype=mimetype, etag=etag, max_age=max_age, conditional=True)
+
+    if max_age is not None:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    if immutable:
+        response.cache_control.immutable = True
+    return response
@@ -0,0 +1,56 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import Callable
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[[], None]
+    depends_on: list[str] = field(default_factory=list)
+
+
+def run_stages(stages: list[Stage], max_workers: int = 4):
+    """
+    의존성이 모두 끝난 stage부터 병렬로 실행합니다.
+    stage 하나가 실패하면 새 stage는 시작하지 않고, 실행 중인 stage가 끝나길 기다린 뒤 첫 에러를 다시 던집니다.
+    """
+    stage_by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dependency in stage.depends_on:
+            if dependency not in stage_by_name:
+                raise ValueError(f"Unknown dependency {dependency} of stage {stage.name}")
+
+    done = set()
+    started = set()
+    first_error = None
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage") as executor:
+        running = {}
+        while True:
+            if first_error is None:
+                for stage in stages:
+                    if stage.name in started:
+                        continue
+                    if all(dependency in done for dependency in stage.depends_on):
+                        started.add(stage.name)
+                        running[executor.submit(stage.func)] = stage.name
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    done.add(name)
+                except Exception as e:
+                    logging.error(f"stage {name} failed: {e}")
+                    if first_error is None:
+                        first_error = e
+
+    if first_error is not None:
+        raise first_error
+    if len(done) != len(stages):
+        raise ValueError(f"Stages not run because of a dependency cycle: {sorted(set(stage_by_name) - done)}")
@@ -0,0 +1,63 @@
+import os
+
+from PIL import ImageFont
+
+from video_editor import SUBTITLE_FONT_PATH, SUBTITLE_FONT_SIZE, SUBTITLE_STROKE_WIDTH, SUBTITLE_TOP, \
+    get_subtitle_spans
+
+SUBTITLE_FONTS_DIR = os.path.dirname(SUBTITLE_FONT_PATH)
+
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: {width}
+PlayResY: {height}
+WrapStyle: 2
+ScaledBorderAndShadow: yes
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,{font_name},{font_size},&H00FFFFFF,&H00FFFFFF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,{outline},0,8,0,0,{margin_v},1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+
+def get_font_name(font_path: str) -> str:
+    """ libass는 fontsdir 안의 폰트를 파일명이 아니라 family 이름으로 찾습니다. """
+    family, _ = ImageFont.truetype(font_path, SUBTITLE_FONT_SIZE).getname()
+    return family
+
+
+def format_ass_time(sec: float) -> str:
+    centiseconds = int(round(max(sec, 0) * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    seconds, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
+
+
+def escape_ass_text(text: str) -> str:
+    # 중괄호는 override 태그, 역슬래시는 \N 같은 이스케이프로 해석되므로 바꿔둡니다.
+    return text.replace("\\", "\uff3c").replace("{", "\\{").replace("}", "\\}").replace("\n", " ")
+
+
+def write_ass_file(timestamps, output_path: str, video_size):
+    """ (단어, 끝 시간) 목록을 MoviePy TextClip과 같은 폰트 / 외곽선 / 위치의 ASS 자막 파일로 씁니다. """
+    width, height = video_size
+    lines = [ASS_HEADER.format(
+        width=width,
+        height=height,
+        font_name=get_font_name(SUBTITLE_FONT_PATH),
+        font_size=SUBTITLE_FONT_SIZE,
+        outline=SUBTITLE_STROKE_WIDTH,
+        margin_v=SUBTITLE_TOP)]
+    for word, start_time, end_time in get_subtitle_spans(timestamps):
+        lines.append(
+            f"Dialogue: 0,{format_ass_time(start_time)},{format_ass_time(end_time)},Default,,0,0,0,,"
+            f"{escape_ass_text(word)}\n")
+
+    temp_path = output_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+    os.replace(temp_path, output_path)
@@ -4,17 +4,32 @@ from dataclasses import dataclass, asdict
 import json
 import os
 import random
+import threading
+import time
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-
-import requests
-from config import get_config
-from deeClient import DeeClient
+from typing import Any, Optional
+
+import task_index
+from config import get_config, get_config_bool
+from clip_cache import clip_cache, get_clip_cache_key, get_file_sha256
+from deeClient import DeeClient, DEFAULT_PACING_SEC, DEFAULT_TIMEOUT_SEC, DEE_PROVIDER
+from dee_poller import DeeTaskFailed, DeeWaitCancelled
+from dee_pool import DeeAcquireCancelled, get_dee_token_pool
 from gemini_client import GeminiClient
+from subtitles import write_ass_file
 from video_editor import cut_video, VideoEditor, ffmpeg_merge_videos, synthesize_speech, ffmpeg_merge_audios, \
-    AUDIO_PRE_CUT_SEC
+    AUDIO_PRE_CUT_SEC, ffmpeg_render_single_pass, ffmpeg_burn_subtitles, get_video_size, probe_video, \
+    get_stream_signature, get_uniform_format, StreamingCut
 from google_tts import GoogleTTS
+from downloader import download_video
+from encoding import EncodingProfile, get_encoding_profile, ENCODING_PROFILE_DEFAULT, ENCODING_PROFILE_DRAFT
+from stage_scheduler import Stage, run_stages
+from metrics import observe_render, observe_stage
+from video_providers import ClipCancelled, VideoProvider, get_video_router
 from mutagen.mp3 import MP3
+import ffmpeg
 
 VIDEO_PROMPT = """
 1초 컷: 줌인, 탑뷰 카메라 무빙, 45도 각도 카메라 무빙, 궤도 샷 (Arc Shot / Orbit Shot): 음식의 측면에서 시작하여 45도 각도까지 부드럽게 원을 그리며 돈다, 1인칭 시점으로 먹는 것처럼 보여준다, 젓가락 혹은 손으로 음식 들기
@@ -30,19 +45,87 @@ WORK_CUT_VIDEO = "cut_video"
 WORK_MERGE_VIDEO = "merge_video"
 WORK_GENERATE_SCRIPT = "generate_script"
 WORK_GENERATE_TTS = "generate_tts"
+WORK_DRAFT_PREVIEW = "draft_preview"
 WORK_EDIT_VIDEO = "edit_video"
 WORK_FINISH = "finish"
 
+CLIP_STATUS_UPLOADED = "uploaded"
+CLIP_STATUS_SUBMITTED = "submitted"
+CLIP_STATUS_SUCCEEDED = "succeeded"
+CLIP_STATUS_DOWNLOADED = "downloaded"
+CLIP_STATUS_FAILED = "failed"
+
+WORK_STATS_HISTORY = 10
+
+TTS_MODE_LINES = "lines"
+TTS_MODE_SSML = "ssml"
+TTS_LANGUAGE_CODE = "en-US"
+TTS_VOICE_NAME = "en-US-Chirp3-HD-Achernar"
+# Chirp3 HD 목소리는 SSML mark를 지원하지 않으므로 SSML 모드는 다른 목소리를 씁니다.
+# 대본은 한국어로만 생성하므로 mark를 지원하는 한국어 목소리를 기본으로 씁니다.
+TTS_SSML_VOICE_NAME = "ko-KR-Neural2-A"
+
+SUBTITLE_BACKEND_ASS = "ass"
+SUBTITLE_BACKEND_MOVIEPY = "moviepy"
+
+RENDER_MODE_MOVIEPY = "moviepy"
+RENDER_MODE_FFMPEG = "ffmpeg"
+
+TASK_STATUS_QUEUED = "queued"
+TASK_STATUS_RUNNING = "running"
+TASK_STATUS_DONE = "done"
+TASK_STATUS_FAILED = "failed"
+TASK_STATUS_AWAITING_APPROVAL = "awaiting_approval"
+TASK_STATUS_REJECTED = "rejected"
+
+APPROVAL_APPROVED = "approved"
+APPROVAL_REJECTED = "rejected"
+
 DATA_PATH = os.environ.get("DATA_PATH", "")
 if not DATA_PATH:
     raise ValueError("DATA_PATH is not set")
 
+TASK_CACHE_SIZE = int(os.environ.get("TASK_CACHE_SIZE", "1024"))
+
+# task_id -> ((info.json inode, mtime_ns, size), VideoTask)
+_task_cache = OrderedDict()
+_task_cache_lock = threading.Lock()
+
+def get_voice_language_code(voice_name: str) -> str:
+    """ Google TTS 목소리 이름은 "ko-KR-Neural2-A"처럼 언어 코드로 시작합니다. """
+    return "-".join(voice_name.split("-")[:2])
+
+
 @dataclass
 class VideoCreationOptions:
     business_name: str
     description: str
     mode: str
     cut_length_sec: int
+    encoding_profile: str = ENCODING_PROFILE_DEFAULT
+    # True면 저화질 미리보기를 먼저 만들고 승인을 기다린 뒤 최종 렌더링을 합니다.
+    draft: bool = False
+    # True면 같은 입력으로 만든 대본이 캐시에 있어도 새로 생성합니다.
+    regenerate_script: bool = False
+
+@dataclass
+class ImageInfo:
+    sha256: str
+    size: int
+    width: int
+    height: int
+    mime_type: str
+
+@dataclass
+class ClipState:
+    """ 클립 하나의 생성 진행 상황입니다. 재시작 시 이미 제출한 작업을 이어서 기다리는 데 씁니다. """
+    provider: str = ""
+    token_id: str = ""
+    image_id: Optional[Any] = None
+    submit_id: Optional[Any] = None
+    status: str = ""
+    video_url: str = ""
+    stream_cut: bool = False
 
 class VideoTask:
     @staticmethod
@@ -60,6 +143,36 @@ class VideoTask:
         task.load_info()
         return task
 
+    @staticmethod
+    def load(task_id: str):
+        """ 디렉토리를 만들지 않고 info.json만 읽습니다. 조회용입니다. """
+        task = VideoTask(task_id)
+        task.load_info()
+        return task
+
+    @staticmethod
+    def load_cached(task_id: str):
+        """
+        info.json의 inode/mtime/size가 그대로면 캐시된 VideoTask를 돌려줍니다. stat 한 번으로 끝납니다.
+        save_info는 os.replace로 저장하므로 같은 mtime 안에 같은 크기로 두 번 저장해도 inode가 바뀝니다.
+        돌려받은 객체는 여러 요청이 공유하므로 읽기만 해야 합니다.
+        """
+        stat = os.stat(VideoTask(task_id).get_info_file_path())
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with _task_cache_lock:
+            cached = _task_cache.get(task_id)
+            if cached and cached[0] == version:
+                _task_cache.move_to_end(task_id)
+                return cached[1]
+
+        task = VideoTask.load(task_id)
+        with _task_cache_lock:
+            _task_cache[task_id] = (version, task)
+            _task_cache.move_to_end(task_id)
+            while len(_task_cache) > TASK_CACHE_SIZE:
+                _task_cache.popitem(last=False)
+        return task
+
     @staticmethod
     def load_all():
         tasks = []
@@ -77,13 +190,40 @@ class VideoTask:
                     logging.error(f"Failed to load task {task_id}: {e}")
         return tasks
 
+    @staticmethod
+    def rebuild_index(if_needed: bool = False):
+        # 읽는 동안 저장된 task는 인덱스에 이미 더 최신 값이 있으므로 그보다 이전 시각을 기준으로 넘깁니다.
+        snapshot_at = datetime.now().isoformat()
+        tasks = VideoTask.load_all()
+        task_index.rebuild([task.to_dict() for task in tasks], snapshot_at, if_needed)
+        return len(tasks)
+
+    @staticmethod
+    def query_index(limit: int = None, cursor: str = None, status_list: list[str] = None, descending: bool = True):
+        if task_index.needs_rebuild():
+            # 부팅할 때 모든 worker가 여기로 오지만 실제로는 한 프로세스만 만듭니다.
+            VideoTask.rebuild_index(if_needed=True)
+        return task_index.query(limit, cursor, status_list, descending)
+
     def __init__(self, task_id: str):
         self.task_id = task_id
         self.ext_list = []
+        self.image_info_list = []
+        self.clip_state_list = []
         self.script_list = []
         self.completed_work_list = []
         self.options = VideoCreationOptions("", "", "", 5)
         self.last_access = datetime.min
+        self.status = TASK_STATUS_QUEUED
+        self.error = ""
+        self.render_mode = ""
+        self.approval = ""
+        self.tts_mode = ""
+        self.word_timestamps = []
+        self.tts_duration_list = []
+        self.work_stats = {}
+        # stage들이 병렬로 돌면서 info.json을 저장하므로 직렬화합니다.
+        self.info_lock = threading.RLock()
 
     def serialize(self):
         return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
@@ -92,10 +232,20 @@ class VideoTask:
         return {
             'task_id': self.task_id,
             'ext_list': self.ext_list,
+            'image_info_list': [asdict(image_info) if image_info else None for image_info in self.image_info_list],
+            'clip_state_list': [asdict(clip_state) for clip_state in self.clip_state_list],
             'script_list': self.script_list,
             'completed_work_list': self.completed_work_list,
             'options': asdict(self.options),
-            'last_access': self.last_access.isoformat()
+            'last_access': self.last_access.isoformat(),
+            'status': self.status,
+            'error': self.error,
+            'render_mode': self.render_mode,
+            'approval': self.approval,
+            'tts_mode': self.tts_mode,
+            'word_timestamps': [[word, end_time] for word, end_time in self.word_timestamps],
+            'tts_duration_list': self.tts_duration_list,
+            'work_stats': self.work_stats
         }
 
     def load_info(self):
@@ -104,6 +254,9 @@ class VideoTask:
             obj = json.load(f)
             self.task_id = obj["task_id"]
             self.ext_list = obj["ext_list"]
+            self.image_info_list = [ImageInfo(**image_info) if image_info else None
+                                    for image_info in obj.get("image_info_list", [])]
+            self.clip_state_list = [ClipState(**clip_state) for clip_state in obj.get("clip_state_list", [])]
             self.script_list = obj["script_list"]
             self.completed_work_list = obj["completed_work_list"]
             self.options = VideoCreationOptions(**obj["options"])
@@ -112,11 +265,37 @@ class VideoTask:
                 self.last_access = datetime.fromisoformat(last_access_str)
             else:
                 self.last_access = datetime.min
+            # info.json written before the job queue existed has no status
+            self.status = obj.get("status") or self.get_legacy_status()
+            self.error = obj.get("error", "")
+            self.render_mode = obj.get("render_mode", "")
+            self.approval = obj.get("approval", "")
+            self.tts_mode = obj.get("tts_mode", "")
+            self.word_timestamps = [(word, end_time) for word, end_time in obj.get("word_timestamps", [])]
+            self.tts_duration_list = obj.get("tts_duration_list", [])
+            self.work_stats = obj.get("work_stats", {})
+
+    def get_legacy_status(self):
+        if self.has_work_done(WORK_FINISH):
+            return TASK_STATUS_DONE
+        return TASK_STATUS_FAILED
+
+    def is_finished(self):
+        return self.has_work_done(WORK_FINISH)
 
     def save_info(self):
         path = self.get_info_file_path()
-        with open(path, 'w', encoding='utf-8') as f:
-            f.write(self.serialize())
+        with self.info_lock:
+            self.last_access = datetime.now()
+            # 읽는 쪽이 반쯤 쓰인 파일을 보지 않도록 임시 파일에 쓰고 교체합니다.
+            temp_path = path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(self.serialize())
+            os.replace(temp_path, path)
+            try:
+                task_index.upsert(self.to_dict())
+            except Exception as e:
+                logging.error(f"Failed to index task {self.task_id}: {e}")
 
     def get_work_dir(self):
         return os.path.join(DATA_PATH, self.task_id)
@@ -149,9 +328,21 @@ class VideoTask:
     def get_merged_tts_path(self):
         return os.path.abspath(os.path.join(self.get_work_dir(), "merged.mp3"))
 
+    def get_subtitle_path(self):
+        return os.path.abspath(os.path.join(self.get_work_dir(), "subtitles.ass"))
+
+    def get_preview_video_path(self):
+        return os.path.abspath(os.path.join(self.get_work_dir(), "preview.mp4"))
+
     def get_final_video_path(self):
         return os.path.abspath(os.path.join(self.get_work_dir(), "final.mp4"))
 
+    def get_thumbnail_path(self, source: str, width: int, fmt: str):
+        return os.path.abspath(os.path.join(self.get_work_dir(), "thumb", f"{source}_{width}.{fmt}"))
+
+    def get_poster_frame_path(self):
+        return os.path.abspath(os.path.join(self.get_work_dir(), "thumb", "poster.png"))
+
     def get_image_count(self):
         return len(self.ext_list)
 
@@ -160,19 +351,56 @@ class VideoTask:
             raise Exception("No image")
         return self.get_image_path(0)
 
-    def add_image(self, ext: str) -> str:
+    def get_image_info(self, index: int):
+        if index < len(self.image_info_list):
+            return self.image_info_list[index]
+        return None
+
+    def get_clip_state(self, index: int) -> ClipState:
+        with self.info_lock:
+            while len(self.clip_state_list) <= index:
+                self.clip_state_list.append(ClipState())
+            return self.clip_state_list[index]
+
+    def update_clip_state(self, index: int, **changes):
+        with self.info_lock:
+            clip_state = self.get_clip_state(index)
+            for key, value in changes.items():
+                setattr(clip_state, key, value)
+            self.save_info()
+
+    def check_cancelled(self, cancel_event: threading.Event, index: int):
+        if cancel_event.is_set():
+            raise ClipCancelled(f"clip {index} cancelled")
+
+    def update_attempt_state(self, cancel_event: threading.Event, index: int, **changes):
+        """ hedging에서 취소된 요청이 이긴 쪽 결과나 이후 단계의 info.json을 덮어쓰지 않도록 취소 여부를 같은 lock 안에서 확인합니다. """
+        with self.info_lock:
+            self.check_cancelled(cancel_event, index)
+            self.update_clip_state(index, **changes)
+
+    def get_upload_temp_path(self):
+        return os.path.abspath(os.path.join(self.get_work_dir(), "input", "upload.part"))
+
+    def add_image(self, ext: str, image_info: ImageInfo = None) -> str:
         path = os.path.join(self.get_work_dir(), "input", str(self.get_image_count()) + ext)
+        # ext_list와 인덱스를 맞추기 위해 정보가 없는 이미지는 None으로 채웁니다.
+        while len(self.image_info_list) < len(self.ext_list):
+            self.image_info_list.append(None)
         self.ext_list.append(ext)
+        self.image_info_list.append(image_info)
         return path
 
     def has_work_done(self, work_name: str):
         return work_name in self.completed_work_list
 
     def add_work_done(self, work_name: str):
-        self.completed_work_list.append(work_name)
+        with self.info_lock:
+            self.completed_work_list.append(work_name)
 
     def generate_videos(self):
-        with ThreadPoolExecutor(max_workers=1) as executor:
+        max_workers = max(1, min(self.get_image_count(), get_video_router().capacity()))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
             future_to_index = {
                 executor.submit(self.generate_video, index): index 
                 for index in range(self.get_image_count())
@@ -181,64 +409,294 @@ class VideoTask:
             for future in as_completed(future_to_index):
                 future.result()
 
+    def get_image_sha256(self, index: int):
+        image_info = self.get_image_info(index)
+        if image_info:
+            return image_info.sha256
+        return get_file_sha256(self.get_image_path(index))
+
+    def get_clip_cache_key(self, index: int, provider: VideoProvider):
+        return get_clip_cache_key(
+            self.get_image_sha256(index), VIDEO_PROMPT, provider.name, provider.resolution, provider.length_sec)
+
     def generate_video(self, index: int):
-        image_path = self.get_image_path(index)
         output_video_path = self.get_generated_video_path(index)
-        
-        client = DeeClient(
-            token=get_config("dee_token"), 
-            user_agent=get_config("dee_user_agent"))
-        video_url = client.dee_video(VIDEO_PROMPT, image_path)
+        router = get_video_router()
+        providers = router.get_enabled()
+
+        # 같은 사진을 다시 올린 경우 생성된 클립을 재사용합니다. provider가 여럿이어도 클립 하나당 한 번만 셉니다.
+        key_to_provider = {self.get_clip_cache_key(index, provider): provider for provider in providers}
+        cached_key = clip_cache.copy_first_to(list(key_to_provider), output_video_path)
+        if cached_key:
+            provider = key_to_provider[cached_key]
+            logging.info(f"clip cache hit: task {self.task_id} image {index} ({provider.name})")
+            self.update_clip_state(index, provider=provider.name, stream_cut=False)
+            return
+
+        hedging = get_config_bool("video_hedging")
+        clip_state = self.get_clip_state(index)
+        # 이미 제출해둔 작업이 있으면 그 provider를 먼저 기다립니다.
+        preferred = clip_state.provider if clip_state.submit_id or clip_state.video_url else None
+        self.update_clip_state(index, stream_cut=False)
+        winner = router.run(
+            router.rank(providers, preferred),
+            lambda provider, cancel_event: self.generate_provider_clip(
+                index, provider, cancel_event, allow_stream_cut=not hedging),
+            hedging=hedging,
+            on_discard=lambda provider: self.remove_provider_clip(index, provider))
+        os.replace(self.get_provider_video_path(index, winner.name), output_video_path)
+        self.update_clip_state(index, provider=winner.name)
+
+    def get_provider_video_path(self, index: int, provider_name: str):
+        return os.path.abspath(os.path.join(self.get_work_dir(), "video", f"{index}.{provider_name}.mp4"))
+
+    def generate_provider_clip(self, index: int, provider: VideoProvider, cancel_event: threading.Event,
+                               allow_stream_cut: bool):
+        output_path = self.get_provider_video_path(index, provider.name)
+        provider.generate(self, index, VIDEO_PROMPT, output_path, allow_stream_cut, cancel_event)
+        try:
+            clip_cache.put_file(self.get_clip_cache_key(index, provider), output_path)
+        except Exception as e:
+            logging.error(f"Failed to cache clip {index} ({provider.name}): {e}")
+
+    def remove_provider_clip(self, index: int, provider: VideoProvider):
+        # hedging에서 늦게 끝난 결과입니다. 캐시에는 남아 있습니다.
+        path = self.get_provider_video_path(index, provider.name)
+        if os.path.exists(path):
+            os.remove(path)
 
+    def generate_dee_clip(self, index: int, prompt: str, output_video_path: str, allow_stream_cut: bool,
+                          cancel_event: threading.Event):
+        video_url = self.get_clip_state(index).video_url
         if not video_url:
-            raise Exception("no video url")
-
-        # download video_url into output_video_path
-        response = requests.get(video_url, stream=True)
-        if response.status_code == 200:
-            with open(output_video_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-        else:
-            raise Exception(f"Failed to download video from {video_url}, status code: {response.status_code}")
+            video_url = self.request_clip_video_url(index, prompt, cancel_event)
+        self.check_cancelled(cancel_event, index)
+
+        # 옵션을 켜면 내려받는 동안 자르기도 같이 진행합니다.
+        streaming_cut = None
+        if (allow_stream_cut and get_config_bool("stream_cut")
+                and not self.is_single_pass_render()):
+            streaming_cut = StreamingCut(self.get_cutted_video_path(index), self.options.cut_length_sec)
+        try:
+            download_video(video_url, output_video_path, consumer=streaming_cut)
+        except Exception:
+            if streaming_cut:
+                streaming_cut.abort()
+            # 주소가 만료됐을 수 있으므로 다음 실행에서는 다시 조회합니다.
+            self.update_attempt_state(cancel_event, index, video_url="", status=CLIP_STATUS_SUBMITTED)
+            raise
+        stream_cut = bool(streaming_cut and streaming_cut.finish())
+        self.update_attempt_state(cancel_event, index, status=CLIP_STATUS_DOWNLOADED, stream_cut=stream_cut)
+
+    def acquire_dee_token(self, index: int, cancel_event: threading.Event):
+        """ 이미 제출한 작업이 있으면 그 작업을 제출한 토큰을 기다리고, 토큰이 빠졌으면 처음부터 다시 합니다. """
+        pool = get_dee_token_pool()
+        clip_state = self.get_clip_state(index)
+        try:
+            if clip_state.token_id:
+                if pool.find(clip_state.token_id):
+                    return pool, pool.acquire(token_id=clip_state.token_id, cancel_event=cancel_event)
+                logging.info(f"dee token {clip_state.token_id} is gone, resubmitting clip {index}")
+                self.update_attempt_state(cancel_event, index, token_id="", image_id=None, submit_id=None, status="")
+            return pool, pool.acquire(cancel_event=cancel_event)
+        except DeeAcquireCancelled as e:
+            raise ClipCancelled(str(e))
+
+    def request_clip_video_url(self, index: int, prompt: str, cancel_event: threading.Event):
+        """
+        업로드 / 제출 / 완료 단계마다 info.json에 저장해서 재시작 후에도 이어서 진행합니다.
+        cancel_event가 set되면 다음 단계로 넘어가지 않고 ClipCancelled를 던집니다.
+        """
+        pool, token = self.acquire_dee_token(index, cancel_event)
+        try:
+            client = DeeClient(
+                token=token.token,
+                user_agent=get_config("dee_user_agent"),
+                pacing_sec=float(get_config("dee_pacing_sec", DEFAULT_PACING_SEC)))
+            timeout_sec = float(get_config("dee_timeout_sec", DEFAULT_TIMEOUT_SEC))
+
+            clip_state = self.get_clip_state(index)
+            if not clip_state.submit_id:
+                if not clip_state.image_id:
+                    # 토큰을 기다리는 사이에 다른 provider가 이겼으면 업로드하지 않습니다.
+                    self.check_cancelled(cancel_event, index)
+                    image_info = self.get_image_info(index)
+                    if image_info:
+                        image_id = client.upload_image(
+                            self.get_image_path(index),
+                            width=image_info.width, height=image_info.height, mime_type=image_info.mime_type)
+                    else:
+                        image_id = client.upload_image(self.get_image_path(index))
+                    self.update_attempt_state(cancel_event, index, provider=DEE_PROVIDER, token_id=token.token_id,
+                                              image_id=image_id, status=CLIP_STATUS_UPLOADED)
+                    client.pace()
+                self.check_cancelled(cancel_event, index)
+                submit_id = client.request_submit(prompt, self.get_clip_state(index).image_id)
+                self.update_attempt_state(cancel_event, index, submit_id=submit_id, status=CLIP_STATUS_SUBMITTED)
+
+            try:
+                video_url = client.wait_video(self.get_clip_state(index).submit_id, timeout_sec, cancel_event)
+            except DeeWaitCancelled as e:
+                raise ClipCancelled(str(e))
+            except DeeTaskFailed:
+                # 실패한 작업은 다음 실행에서 새로 제출합니다.
+                self.update_attempt_state(cancel_event, index, submit_id=None, status=CLIP_STATUS_FAILED)
+                raise
+            if not video_url:
+                raise Exception("no video url")
+            self.update_attempt_state(cancel_event, index, video_url=video_url, status=CLIP_STATUS_SUCCEEDED)
+            pool.release(token, success=True)
+        except Exception:
+            # 취소된 요청은 토큰 상태에 넣지 않습니다.
+            pool.release(token, success=None if cancel_event.is_set() else False)
+            raise
+        return video_url
 
     def cut_videos(self):
-        for index in range(self.get_image_count()):
+        if self.is_single_pass_render():
+            # 자르기는 edit_video의 filtergraph에서 같이 합니다.
+            return
+        indexes = list(range(self.get_image_count()))
+        if not indexes:
+            return
+        max_workers = max(1, min(len(indexes), os.cpu_count() or 1))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # 다운로드하면서 이미 잘라둔 클립도 형식 비교에는 넣어야 합니다.
+            probes = list(executor.map(lambda index: probe_video(self.get_generated_video_path(index)), indexes))
+
+            # 클립마다 형식 / 크기 / 프레임레이트가 다르거나 provider가 섞였으면 -c copy 병합이 깨지므로
+            # 전부 첫 클립에 맞춰 다시 인코딩합니다.
+            uniform_format = None
+            providers = set(self.get_clip_state(index).provider for index in indexes)
+            if len(providers) > 1 or len(set(get_stream_signature(probe) for probe in probes)) > 1:
+                uniform_format = get_uniform_format(probes[0])
+            threads = max(1, (os.cpu_count() or 1) // max_workers)
+            futures = [
+                executor.submit(self.cut_clip, index, probe, uniform_format, threads)
+                for index, probe in zip(indexes, probes)
+                if uniform_format or not self.is_stream_cut(index)
+            ]
+            for future in as_completed(futures):
+                future.result()
+
+    def cut_clip(self, index: int, probe: dict, uniform_format, threads: int):
+        # h264가 아니면 cut_video가 다시 인코딩하므로 라벨도 그에 맞춥니다.
+        if uniform_format is None and probe["stream"].get("codec_name") != "h264":
+            uniform_format = get_uniform_format(probe)
+        with observe_render(WORK_CUT_VIDEO, "ffmpeg", "uniform" if uniform_format else "copy"):
             cut_video(
                 self.get_generated_video_path(index),
                 self.get_cutted_video_path(index),
-                self.options.cut_length_sec)
+                self.options.cut_length_sec,
+                probe, uniform_format, threads)
+
+    def is_stream_cut(self, index: int):
+        return self.get_clip_state(index).stream_cut and os.path.exists(self.get_cutted_video_path(index))
 
     def merge_videos(self):
+        if self.is_single_pass_render():
+            return
         input_path_list = [self.get_cutted_video_path(index) for index in range(self.get_image_count())]
-        ffmpeg_merge_videos(input_path_list, self.get_merged_video_path())
+        with observe_render(WORK_MERGE_VIDEO, "ffmpeg", "copy"):
+            ffmpeg_merge_videos(input_path_list, self.get_merged_video_path())
 
     def generate_script(self):
         gemini_client = GeminiClient()
-        script = gemini_client.generate_script(self.options.business_name, self.options.description, self.options.mode)
-        self.script_list = []
+        self.tts_duration_list = []
+        if self.use_script_streaming():
+            self.generate_script_streaming(gemini_client)
+            return
+
+        script = gemini_client.generate_script(self.options.business_name, self.options.description, self.options.mode,
+                                               regenerate=self.options.regenerate_script)
+        script_list = []
         for line in script.split('\n'):
             if line.strip():
-                self.script_list.append(line.strip())
-        
-    def generate_tts(self):
+                script_list.append(line.strip())
+        self.script_list = script_list
+
+    def use_script_streaming(self):
+        # SSML 모드는 대본 전체를 한 요청으로 합성하므로 줄 단위로 미리 합성할 수 없습니다.
+        return (get_config_bool("script_streaming")
+                and get_config("tts_mode", TTS_MODE_LINES) == TTS_MODE_LINES)
+
+    def generate_script_streaming(self, gemini_client: GeminiClient):
+        """ 대본이 한 줄 완성될 때마다 바로 TTS 합성을 시작해서 대본 생성과 TTS를 겹쳐 진행합니다. """
         tts = GoogleTTS()
-        for index, prompt in enumerate(self.script_list):
-            tts_path = self.get_tts_path(index)
-            tts.synthesize_speech(
-                prompt,
-                tts_path,
-                language_code="en-US",
-                voice_name="en-US-Chirp3-HD-Achernar"
-            )
+        script_list = []
+        with ThreadPoolExecutor(max_workers=self.get_tts_concurrency()) as executor:
+            futures = []
+            for line in gemini_client.stream_script_lines(self.options.business_name, self.options.description,
+                                                          self.options.mode, regenerate=self.options.regenerate_script):
+                if not line.strip():
+                    continue
+                futures.append(executor.submit(self.synthesize_line, tts, len(script_list), line.strip()))
+                script_list.append(line.strip())
+            tts_duration_list = [future.result() for future in futures]
+        self.script_list = script_list
+        self.tts_duration_list = tts_duration_list
+
+    def get_tts_concurrency(self):
+        return max(1, int(get_config("tts_max_concurrency", 4)))
+
+    def synthesize_line(self, tts: GoogleTTS, index: int, text: str):
+        return tts.synthesize_speech(
+            text,
+            self.get_tts_path(index),
+            language_code=TTS_LANGUAGE_CODE,
+            voice_name=TTS_VOICE_NAME)
+
+    def has_tts(self, index: int):
+        return (index < len(self.tts_duration_list) and self.tts_duration_list[index] is not None
+                and os.path.exists(self.get_tts_path(index)))
 
-    def edit_video(self):
+    def generate_tts(self):
+        self.tts_mode = get_config("tts_mode", TTS_MODE_LINES)
+        if self.tts_mode == TTS_MODE_SSML:
+            self.generate_tts_ssml()
+            return
+
+        self.word_timestamps = []
+        # 대본 스트리밍 중에 이미 합성한 줄은 건너뜁니다.
+        tts_duration_list = [self.tts_duration_list[index] if self.has_tts(index) else None
+                             for index in range(len(self.script_list))]
+        pending = [index for index, duration in enumerate(tts_duration_list) if duration is None]
+        if pending:
+            tts = GoogleTTS()
+            max_workers = min(len(pending), self.get_tts_concurrency())
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {index: executor.submit(self.synthesize_line, tts, index, self.script_list[index])
+                           for index in pending}
+                for index, future in futures.items():
+                    tts_duration_list[index] = future.result()
+        self.tts_duration_list = tts_duration_list
+
+    def generate_tts_ssml(self):
+        """ 대본 전체를 한 번에 합성해서 merged.mp3와 단어별 끝 시간을 바로 만듭니다. """
+        tts = GoogleTTS()
+        voice_name = get_config("tts_ssml_voice_name", TTS_SSML_VOICE_NAME)
+        self.word_timestamps = tts.synthesize_ssml_with_marks(
+            self.script_list,
+            self.get_merged_tts_path(),
+            language_code=get_voice_language_code(voice_name),
+            voice_name=voice_name)
+
+    def is_ssml_tts(self):
+        return self.tts_mode == TTS_MODE_SSML
+
+    def get_tts_duration(self, index: int):
+        # 합성할 때 저장해둔 길이가 없으면 (이전 버전 task) 파일을 읽습니다.
+        if index < len(self.tts_duration_list) and self.tts_duration_list[index] is not None:
+            return self.tts_duration_list[index]
+        return MP3(self.get_tts_path(index)).info.length
+
+    def get_subtitle_timestamps(self):
+        if self.is_ssml_tts():
+            return self.word_timestamps
         all_timestamps = []
         current_time = 0.0
         for index, prompt in enumerate(self.script_list):
-            tts_path = self.get_tts_path(index)
-            tts_duration = MP3(tts_path).info.length
+            tts_duration = self.get_tts_duration(index)
             timestamps = synthesize_speech(prompt, tts_duration)
 
             adjusted_timestamps = []
@@ -248,36 +706,179 @@ class VideoTask:
 
             all_timestamps.extend(adjusted_timestamps)
             current_time += (tts_duration - AUDIO_PRE_CUT_SEC)
+        return all_timestamps
 
-        tts_files = [self.get_tts_path(index) for index in range(len(self.script_list))]
-        ffmpeg_merge_audios(tts_files, self.get_merged_tts_path())
+    def is_single_pass_render(self):
+        return self.render_mode == RENDER_MODE_FFMPEG
+
+    def use_ass_subtitles(self):
+        return get_config("subtitle_backend", SUBTITLE_BACKEND_ASS) == SUBTITLE_BACKEND_ASS
+
+    def edit_video(self):
+        self.render_video(
+            self.get_final_video_path(), get_encoding_profile(self.options.encoding_profile), WORK_EDIT_VIDEO)
+
+    def render_draft_preview(self):
+        self.render_video(self.get_preview_video_path(), get_encoding_profile(ENCODING_PROFILE_DRAFT), WORK_DRAFT_PREVIEW)
+
+    def render_video(self, output_path: str, encoding: EncodingProfile, stage: str):
+        all_timestamps = self.get_subtitle_timestamps()
+        if self.is_ssml_tts():
+            # SSML 모드는 이미 하나로 합쳐진 오디오를 만들었으므로 앞부분을 자를 필요도 없습니다.
+            tts_files = [self.get_merged_tts_path()]
+            audio_inpoint_sec = 0
+        else:
+            tts_files = [self.get_tts_path(index) for index in range(len(self.script_list))]
+            audio_inpoint_sec = AUDIO_PRE_CUT_SEC
+
+        if self.is_single_pass_render():
+            video_path_list = [self.get_generated_video_path(index) for index in range(self.get_image_count())]
+            ass_path = None
+            if self.use_ass_subtitles():
+                ass_path = self.get_subtitle_path()
+                write_ass_file(all_timestamps, ass_path, get_video_size(video_path_list[0]))
+            try:
+                with observe_render(stage, "ffmpeg_single_pass", encoding.preset):
+                    ffmpeg_render_single_pass(
+                        video_path_list,
+                        self.options.cut_length_sec,
+                        tts_files,
+                        audio_inpoint_sec,
+                        all_timestamps,
+                        output_path,
+                        ass_path,
+                        encoding)
+            except ffmpeg.Error as e:
+                if not ass_path:
+                    raise
+                # libass 없이 빌드된 ffmpeg 등에서는 drawtext로 다시 시도합니다.
+                logging.error(f"ASS subtitle render failed, falling back to drawtext: {e}")
+                with observe_render(stage, "ffmpeg_single_pass_drawtext", encoding.preset):
+                    ffmpeg_render_single_pass(
+                        video_path_list,
+                        self.options.cut_length_sec,
+                        tts_files,
+                        audio_inpoint_sec,
+                        all_timestamps,
+                        output_path,
+                        encoding=encoding)
+            return
+
+        if not self.is_ssml_tts():
+            ffmpeg_merge_audios(tts_files, self.get_merged_tts_path())
+
+        if self.use_ass_subtitles():
+            ass_path = self.get_subtitle_path()
+            try:
+                write_ass_file(all_timestamps, ass_path, get_video_size(self.get_merged_video_path()))
+                with observe_render(stage, "ffmpeg_ass", encoding.preset):
+                    ffmpeg_burn_subtitles(
+                        self.get_merged_video_path(),
+                        self.get_merged_tts_path(),
+                        ass_path,
+                        output_path,
+                        encoding)
+                return
+            except Exception as e:
+                logging.error(f"ASS subtitle render failed, falling back to MoviePy: {e}")
 
         editor = VideoEditor(
             self.get_merged_video_path(), 
             self.get_merged_tts_path())
 
         editor.add_subtitles_from_timestamps(all_timestamps)
-        editor.composite_video(self.get_final_video_path())
+        with observe_render(stage, "moviepy", encoding.preset):
+            editor.composite_video(output_path, encoding)
 
     def run_work(self, work_name: str, func):
         try:
             if not self.has_work_done(work_name):
-                func()
+                self.time_work(work_name, func)
                 self.add_work_done(work_name)
         except Exception as e:
             raise e
         finally:
             self.save_info()
 
+    def time_work(self, work_name: str, func):
+        started_at = time.time()
+        error = None
+        try:
+            with observe_stage(work_name):
+                func()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.record_work_stats(work_name, time.time() - started_at, error)
+
+    def record_work_stats(self, work_name: str, duration_sec: float, error: Exception = None):
+        """ 실행할 때마다 시도 횟수와 소요 시간, 에러를 info.json에 남깁니다. 최근 WORK_STATS_HISTORY개만 유지합니다. """
+        with self.info_lock:
+            stats = self.work_stats.setdefault(work_name, {"attempts": 0, "durations_sec": [], "errors": []})
+            stats["attempts"] += 1
+            stats["durations_sec"] = (stats["durations_sec"] + [round(duration_sec, 3)])[-WORK_STATS_HISTORY:]
+            if error is not None:
+                stats["errors"] = (stats["errors"] + [str(error)])[-WORK_STATS_HISTORY:]
+
+    def set_status(self, status: str, error: str = ""):
+        self.status = status
+        self.error = error
+        self.save_info()
+
+    def get_stages(self):
+        render_dependencies = [WORK_MERGE_VIDEO, WORK_GENERATE_TTS]
+        stages = [
+            Stage(WORK_GENERATE_VIDEO, lambda: self.run_work(WORK_GENERATE_VIDEO, self.generate_videos)),
+            Stage(WORK_CUT_VIDEO, lambda: self.run_work(WORK_CUT_VIDEO, self.cut_videos),
+                  [WORK_GENERATE_VIDEO]),
+            Stage(WORK_MERGE_VIDEO, lambda: self.run_work(WORK_MERGE_VIDEO, self.merge_videos),
+                  [WORK_CUT_VIDEO]),
+            # 대본과 TTS는 options만 있으면 되므로 영상 생성과 동시에 진행합니다.
+            Stage(WORK_GENERATE_SCRIPT, lambda: self.run_work(WORK_GENERATE_SCRIPT, self.generate_script)),
+            Stage(WORK_GENERATE_TTS, lambda: self.run_work(WORK_GENERATE_TTS, self.generate_tts),
+                  [WORK_GENERATE_SCRIPT]),
+        ]
+        if self.options.draft:
+            stages.append(Stage(WORK_DRAFT_PREVIEW,
+                                lambda: self.run_work(WORK_DRAFT_PREVIEW, self.render_draft_preview),
+                                render_dependencies))
+            if self.approval != APPROVAL_APPROVED:
+                # 승인 전에는 미리보기까지만 만듭니다.
+                return stages
+            render_dependencies = [WORK_DRAFT_PREVIEW]
+        stages += [
+            Stage(WORK_EDIT_VIDEO, lambda: self.run_work(WORK_EDIT_VIDEO, self.edit_video),
+                  render_dependencies),
+            Stage(WORK_FINISH, lambda: self.run_work(WORK_FINISH, lambda: None),
+                  [WORK_EDIT_VIDEO]),
+        ]
+        return stages
+
+    def approve(self):
+        if self.status != TASK_STATUS_AWAITING_APPROVAL:
+            raise ValueError(f"Task {self.task_id} is not awaiting approval ({self.status})")
+        self.approval = APPROVAL_APPROVED
+        self.set_status(TASK_STATUS_QUEUED)
+
+    def reject(self):
+        if self.status != TASK_STATUS_AWAITING_APPROVAL:
+            raise ValueError(f"Task {self.task_id} is not awaiting approval ({self.status})")
+        self.approval = APPROVAL_REJECTED
+        self.set_status(TASK_STATUS_REJECTED)
+
     def run(self):
+        # 중간에 config가 바뀌어도 한 task는 처음 정한 방식으로 끝까지 렌더링합니다.
+        if not self.render_mode:
+            self.render_mode = get_config("render_mode", RENDER_MODE_MOVIEPY)
+        self.set_status(TASK_STATUS_RUNNING)
         try:
-            self.run_work(WORK_GENERATE_VIDEO, lambda: self.generate_videos())
-            self.run_work(WORK_CUT_VIDEO, lambda: self.cut_videos())
-            self.run_work(WORK_MERGE_VIDEO, lambda: self.merge_videos())
-            self.run_work(WORK_GENERATE_SCRIPT, lambda: self.generate_script())
-            self.run_work(WORK_GENERATE_TTS, lambda: self.generate_tts())
-            self.run_work(WORK_EDIT_VIDEO, lambda: self.edit_video())
-            self.run_work(WORK_FINISH, lambda: None)
+            run_stages(self.get_stages())
+            if self.is_finished():
+                self.set_status(TASK_STATUS_DONE)
+            else:
+                self.set_status(TASK_STATUS_AWAITING_APPROVAL)
         except Exception as e:
             logging.error(f"Error in run: {e}")
-            raise e
\ No newline at end of file
+            self.set_status(TASK_STATUS_FAILED, str(e))
+            raise e
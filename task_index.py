@@ -0,0 +1,130 @@
+import base64
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+DATA_PATH = os.environ.get("DATA_PATH", "")
+TASK_INDEX_PATH = os.environ.get("TASK_INDEX_PATH", "") or os.path.join(DATA_PATH, "tasks.sqlite3")
+MAX_LIMIT = 500
+
+_local = threading.local()
+
+
+def get_connection() -> sqlite3.Connection:
+    """ 스레드마다 하나의 연결을 씁니다. 처음 만들어진 인덱스라면 needs_rebuild()가 True가 됩니다. """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(TASK_INDEX_PATH)), exist_ok=True)
+        conn = sqlite3.connect(TASK_INDEX_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                last_access TEXT NOT NULL,
+                data TEXT NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS tasks_last_access ON tasks (last_access, task_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, last_access, task_id)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+
+def needs_rebuild() -> bool:
+    row = get_connection().execute("SELECT value FROM meta WHERE key = 'built'").fetchone()
+    return row is None
+
+
+def upsert(task_dict: dict):
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO tasks (task_id, status, last_access, data) VALUES (?, ?, ?, ?)",
+            (task_dict["task_id"], task_dict["status"], task_dict["last_access"],
+             json.dumps(task_dict, ensure_ascii=False)))
+
+
+def rebuild(task_dicts: list[dict], snapshot_at: str, if_needed: bool = False) -> bool:
+    """
+    디스크에서 읽은 task 목록으로 인덱스를 다시 맞춥니다.
+    여러 프로세스가 동시에 부를 수 있으므로 쓰기 트랜잭션 안에서 처리하고, 그 사이 save_info가 넣은 더 최신 행은 덮어쓰거나 지우지 않습니다.
+    :param snapshot_at: task 목록을 읽기 시작한 시각(last_access 형식). 그 뒤에 생긴 행은 목록에 없어도 남깁니다.
+    :param if_needed: True면 다른 프로세스가 이미 만들었을 때 아무것도 하지 않습니다.
+    :return: 다시 만들었으면 True
+    """
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if if_needed and not needs_rebuild():
+            conn.rollback()
+            return False
+        conn.executemany(
+            """
+            INSERT INTO tasks (task_id, status, last_access, data) VALUES (?, ?, ?, ?)
+            ON CONFLICT (task_id) DO UPDATE SET
+                status = excluded.status, last_access = excluded.last_access, data = excluded.data
+            WHERE excluded.last_access >= tasks.last_access
+            """,
+            [(d["task_id"], d["status"], d["last_access"], json.dumps(d, ensure_ascii=False)) for d in task_dicts])
+        task_ids = {d["task_id"] for d in task_dicts}
+        stale_ids = [row[0] for row in conn.execute(
+            "SELECT task_id FROM tasks WHERE last_access < ?", (snapshot_at,)) if row[0] not in task_ids]
+        conn.executemany("DELETE FROM tasks WHERE task_id = ?", [(task_id,) for task_id in stale_ids])
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', '1')")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logging.info(f"task index rebuilt with {len(task_dicts)} tasks")
+    return True
+
+
+def encode_cursor(last_access: str, task_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([last_access, task_id]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    try:
+        last_access, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return last_access, task_id
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def query(limit: int = None, cursor: str = None, status_list: list[str] = None, descending: bool = True):
+    """
+    last_access 순으로 task dict 목록을 돌려줍니다.
+    :return: (task dict 목록, 다음 페이지 cursor 또는 None)
+    """
+    where = []
+    params = []
+    if status_list:
+        where.append(f"status IN ({', '.join('?' for _ in status_list)})")
+        params.extend(status_list)
+    if cursor:
+        last_access, task_id = decode_cursor(cursor)
+        op = "<" if descending else ">"
+        where.append(f"(last_access {op} ? OR (last_access = ? AND task_id {op} ?))")
+        params.extend([last_access, last_access, task_id])
+
+    order = "DESC" if descending else "ASC"
+    sql = "SELECT task_id, last_access, data FROM tasks"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY last_access {order}, task_id {order}"
+    if limit is not None:
+        limit = max(1, min(limit, MAX_LIMIT))
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+
+    rows = get_connection().execute(sql, params).fetchall()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+    return [json.loads(row[2]) for row in rows], next_cursor
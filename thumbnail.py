@@ -0,0 +1,97 @@
+import os
+import threading
+
+import ffmpeg
+from PIL import Image, ImageOps
+
+THUMBNAIL_WIDTHS = [160, 320, 640, 1280]
+DEFAULT_THUMBNAIL_WIDTH = 320
+POSTER_FRAME_SEC = 0.5
+
+SOURCE_IMAGE = "image"
+SOURCE_POSTER = "poster"
+# 썸네일 파일 이름에 그대로 들어가므로 이 값만 받습니다.
+THUMBNAIL_SOURCES = (SOURCE_IMAGE, SOURCE_POSTER)
+
+FORMAT_WEBP = "webp"
+FORMAT_JPEG = "jpeg"
+MIME_TYPES = {
+    FORMAT_WEBP: "image/webp",
+    FORMAT_JPEG: "image/jpeg",
+}
+
+
+def snap_width(width: int) -> int:
+    """ 캐시 파일이 무한히 늘지 않도록 요청한 너비를 정해진 크기 중 하나로 맞춥니다. """
+    for candidate in THUMBNAIL_WIDTHS:
+        if width <= candidate:
+            return candidate
+    return THUMBNAIL_WIDTHS[-1]
+
+
+def is_fresh(path: str, source_path: str) -> bool:
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source_path)
+
+
+def get_temp_path(output_path: str, ext: str = "") -> str:
+    # 여러 worker가 같은 썸네일을 동시에 만들 수 있으므로 임시 파일 이름이 겹치지 않게 합니다.
+    return f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp{ext}"
+
+
+def extract_poster_frame(video_path: str, output_path: str):
+    # ffmpeg가 확장자로 출력 형식을 고르므로 .png로 끝나야 합니다.
+    temp_path = get_temp_path(output_path, ".png")
+    try:
+        (ffmpeg
+         .input(video_path, ss=POSTER_FRAME_SEC)
+         .output(temp_path, vframes=1)
+         .global_args("-y", "-loglevel", "error")
+         .run())
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def resize_image(source_path: str, output_path: str, width: int, fmt: str):
+    with Image.open(source_path) as img:
+        # 휴대폰 사진은 EXIF 회전 정보를 반영해야 똑바로 보입니다.
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("RGB")
+        img.thumbnail((width, width * 4))
+
+        temp_path = get_temp_path(output_path)
+        try:
+            if fmt == FORMAT_WEBP:
+                img.save(temp_path, format="WEBP", quality=80, method=4)
+            else:
+                img.save(temp_path, format="JPEG", quality=85, optimize=True, progressive=True)
+            os.replace(temp_path, output_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def get_thumbnail_source_path(task, source: str) -> str:
+    if source == SOURCE_POSTER:
+        video_path = task.get_final_video_path()
+        if not os.path.exists(video_path):
+            raise FileNotFoundError("Final video is not rendered yet")
+        poster_path = task.get_poster_frame_path()
+        if not is_fresh(poster_path, video_path):
+            os.makedirs(os.path.dirname(poster_path), exist_ok=True)
+            extract_poster_frame(video_path, poster_path)
+        return poster_path
+    return task.get_thumbnail_image_path()
+
+
+def get_thumbnail(task, source: str, width: int, fmt: str) -> str:
+    """ 요청한 크기의 썸네일 경로를 돌려줍니다. 없거나 원본보다 오래됐으면 만듭니다. """
+    if source not in THUMBNAIL_SOURCES:
+        raise ValueError(f"Unknown thumbnail source: {source}")
+    source_path = get_thumbnail_source_path(task, source)
+    thumbnail_path = task.get_thumbnail_path(source, width, fmt)
+    if not is_fresh(thumbnail_path, source_path):
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+        resize_image(source_path, thumbnail_path, width, fmt)
+    return thumbnail_path
@@ -0,0 +1,13 @@
+import os
+
+from disk_cache import DiskCache, make_cache_key
+
+DATA_PATH = os.environ.get("DATA_PATH", "")
+TTS_CACHE_PATH = os.environ.get("TTS_CACHE_PATH", "") or os.path.join(DATA_PATH, "_cache", "tts")
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+tts_cache = DiskCache(TTS_CACHE_PATH, TTS_CACHE_MAX_BYTES, ".mp3")
+
+
+def get_tts_cache_key(text: str, language_code: str, voice_name: str, speaking_rate: float, encoding: str) -> str:
+    return make_cache_key("tts", text, language_code, voice_name, float(speaking_rate), encoding)
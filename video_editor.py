@@ -1,39 +1,158 @@
+import json
 import os
 import random
+import subprocess
 import tempfile
 import ffmpeg
 from mutagen.mp3 import MP3
+from encoding import EncodingProfile
 from moviepy.video.io.VideoFileClip import VideoFileClip
 from moviepy.audio.io.AudioFileClip import AudioFileClip
 from moviepy.video.VideoClip import TextClip
 from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
 
 AUDIO_PRE_CUT_SEC = 0.1
+FASTSTART_PARAMS = ["-movflags", "+faststart"]
+
+SUBTITLE_FONT_PATH = "static/fonts/87MMILSANG-Oblique.ttf"
+SUBTITLE_FONT_SIZE = 60
+SUBTITLE_STROKE_WIDTH = 5
+SUBTITLE_MARGIN = (20, 10)
+# TextClip은 margin만큼 안쪽에 글자를 그리므로 y 위치에 세로 margin을 더합니다.
+SUBTITLE_TOP = 400 + SUBTITLE_MARGIN[1]
 
 def get_temp_file_path(ext: str):
     id = random.randint(100000, 999999)
     return os.path.join(tempfile.gettempdir(), f"temp_{str(id)}.{ext}")
 
-# ffmpeg -i input_path -t video_length_sec -c copy output_path -y
-def cut_video(input_path: str, output_path: str, video_length_sec: int):
+UNIFORM_ENCODE_ARGS = {"vcodec": "libx264", "pix_fmt": "yuv420p", "an": None, "video_track_timescale": "15360"}
+DEFAULT_FRAME_RATE = "30"
+
+def probe_video(input_path: str) -> dict:
+    """
+    ffprobe로 첫 영상 스트림 정보와 길이를 읽습니다.
+    :return: {"stream": {...}, "duration": float}
+    """
+    result = subprocess.run([
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name,profile,width,height,pix_fmt,time_base,r_frame_rate:format=duration",
+        "-of", "json",
+        input_path,
+    ], capture_output=True, check=True)
+    obj = json.loads(result.stdout)
+    streams = obj.get("streams", [])
+    if not streams:
+        raise Exception(f"No video stream: {input_path}")
+    return {
+        "stream": streams[0],
+        "duration": float(obj.get("format", {}).get("duration") or 0),
+    }
+
+def get_stream_signature(probe: dict):
+    """ concat demuxer로 -c copy 병합하려면 이 값들이 모든 클립에서 같아야 합니다. """
+    stream = probe["stream"]
+    return tuple(stream.get(key) for key in
+                 ("codec_name", "profile", "width", "height", "pix_fmt", "time_base", "r_frame_rate"))
+
+def get_uniform_format(probe: dict):
+    """
+    클립들을 다시 인코딩할 때 맞출 (너비, 높이, 프레임레이트)입니다. 기준 클립의 값을 씁니다.
+    yuv420p는 짝수 크기만 되므로 내림해서 맞춥니다.
+    """
+    stream = probe["stream"]
+    width = int(stream["width"]) // 2 * 2
+    height = int(stream["height"]) // 2 * 2
+    frame_rate = stream.get("r_frame_rate")
+    if not frame_rate or frame_rate.startswith("0"):
+        frame_rate = DEFAULT_FRAME_RATE
+    return width, height, frame_rate
+
+def fit_video(stream, uniform_format):
+    """ 비율을 유지한 채 (너비, 높이) 안에 맞추고 남는 곳은 여백으로 채운 뒤 프레임레이트를 맞춥니다. """
+    width, height, frame_rate = uniform_format
+    return (stream
+            .filter("scale", width, height, force_original_aspect_ratio="decrease")
+            .filter("pad", width, height, "(ow-iw)/2", "(oh-ih)/2")
+            .filter("setsar", 1)
+            .filter("fps", frame_rate))
+
+# ffmpeg -i input_path -t video_length_sec -an -c copy output_path -y
+def cut_video(input_path: str, output_path: str, video_length_sec: int,
+              probe: dict = None, uniform_format=None, threads: int = 0):
+    """
+    앞에서부터 video_length_sec만큼 자릅니다. 시작점이 첫 키프레임이므로 보통은 스트림 복사로 충분합니다.
+    uniform_format (너비, 높이, 프레임레이트)를 주면 -c copy로 이어 붙일 수 있도록 그 크기 / 프레임레이트로 다시 인코딩합니다.
+    비율이 다르면 잘라내지 않고 여백을 넣습니다. h264가 아니면 원래 크기로 다시 인코딩합니다.
+    """
     if os.path.exists(output_path):
         os.remove(output_path)
+    if probe is None:
+        probe = probe_video(input_path)
+    if uniform_format is None and probe["stream"].get("codec_name") != "h264":
+        uniform_format = get_uniform_format(probe)
 
-    if video_length_sec > 0:
-        (ffmpeg
-        .input(input_path)
-        .output(output_path, an=None)
-        .global_args("-y")
-        .run())
+    length_args = {"t": video_length_sec} if video_length_sec > 0 else {}
+    if uniform_format:
+        video = fit_video(ffmpeg.input(input_path).video, uniform_format)
+        output = ffmpeg.output(video, output_path, **UNIFORM_ENCODE_ARGS, threads=threads, **length_args)
     else:
-        f = (ffmpeg
-        .input(input_path)
-        .output(output_path, an=None)
-        .global_args("-y")
-        #.compile())
-        .run())
-        #f = " ".join(f)
-        #print(f)
+        output = ffmpeg.input(input_path).output(
+            output_path, c="copy", an=None, avoid_negative_ts="make_zero", **length_args)
+    output.global_args("-y", "-loglevel", "error").run()
+
+class StreamingCut:
+    """
+    다운로드 중인 바이트를 ffmpeg stdin으로 흘려 받으면서 바로 자르기를 시작합니다.
+    moov atom이 파일 끝에 있는 mp4는 파이프로 읽을 수 없으므로 실패할 수 있고, 그때는 디스크에서 다시 자르면 됩니다.
+    """
+
+    def __init__(self, output_path: str, video_length_sec: int):
+        self.output_path = output_path
+        self.temp_path = output_path + ".stream.mp4"
+        self.failed = False
+        # cut_video와 같이 앞에서부터 스트림 복사로 자릅니다.
+        output_args = {"c": "copy", "an": None}
+        if video_length_sec > 0:
+            output_args["t"] = video_length_sec
+        self.process = (ffmpeg
+            .input("pipe:0")
+            .output(self.temp_path, **output_args)
+            .global_args("-y", "-loglevel", "error")
+            .run_async(pipe_stdin=True))
+
+    def write(self, chunk: bytes):
+        if self.failed:
+            return
+        try:
+            self.process.stdin.write(chunk)
+        except (BrokenPipeError, OSError):
+            self.abort()
+
+    def abort(self):
+        if self.failed:
+            return
+        self.failed = True
+        self.process.kill()
+        self.process.wait()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def finish(self) -> bool:
+        """ 성공하면 output_path에 잘린 영상이 생기고 True를 돌려줍니다. """
+        if self.failed:
+            return False
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        if self.process.wait() != 0:
+            self.failed = True
+            if os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+            return False
+        os.replace(self.temp_path, self.output_path)
+        return True
 
 def ffmpeg_merge_videos(input_path_list: list[str], output_path: str):
     if os.path.exists(output_path):
@@ -120,14 +239,14 @@ class SubtitleClip:
         """ SubtitleClip을 MoviePy의 TextClip으로 변환합니다. """
         clip = TextClip(
             text=self.text,
-            font_size=int(60),
+            font_size=SUBTITLE_FONT_SIZE,
             color="white",
             #font='static/fonts/firstFont.ttf',
-            font='static/fonts/87MMILSANG-Oblique.ttf',
+            font=SUBTITLE_FONT_PATH,
             method="label",
-            stroke_width=5,
+            stroke_width=SUBTITLE_STROKE_WIDTH,
             stroke_color="black",
-            margin=(20, 10))
+            margin=SUBTITLE_MARGIN)
 
         pos_x = (video_size[0] - clip.size[0]) / 2
         return (clip.with_position((int(pos_x), 400), False)
@@ -154,7 +273,8 @@ class VideoEditor:
             if duration > 0:
                 self.subtitles.append(SubtitleClip(word, start_time, duration))
 
-    def composite_video(self, output_path="final_video.mp4"):
+    def composite_video(self, output_path="final_video.mp4", encoding: EncodingProfile = None):
+        encoding = encoding or EncodingProfile()
         subtitle_clips = [sub.to_textclip(self.video_clip.size) for sub in self.subtitles]
         # 비디오 클립의 길이를 오디오 길이에 맞춥니다.
         if self.video_clip.duration > self.audio_clip.duration:
@@ -164,7 +284,101 @@ class VideoEditor:
 
         self.video_clip = CompositeVideoClip([self.video_clip] + subtitle_clips)
         self.video_clip = self.video_clip.with_audio(self.audio_clip)
-        self.video_clip.write_videofile(output_path, codec="libx264", audio_codec="aac")
+        if encoding.height:
+            # libx264(yuv420p)는 홀수 너비를 인코딩하지 못하므로 짝수로 맞춥니다.
+            width, height = self.video_clip.size
+            scaled_width = int(round(width * encoding.height / height / 2)) * 2
+            self.video_clip = self.video_clip.resized(new_size=(scaled_width, encoding.height))
+        # moov atom을 파일 앞에 두어 모바일에서 전체를 받기 전에 재생이 시작되도록 합니다.
+        self.video_clip.write_videofile(
+            output_path, codec="libx264", audio_codec="aac",
+            preset=encoding.preset,
+            threads=encoding.threads or None,
+            ffmpeg_params=FASTSTART_PARAMS + encoding.to_moviepy_ffmpeg_params())
+
+def get_subtitle_spans(timestamps):
+    """ (단어, 끝 시간) 목록을 (단어, 시작 시간, 끝 시간) 목록으로 바꿉니다. 앞 자막의 끝이 다음 자막의 시작입니다. """
+    spans = []
+    for i, (word, end_time) in enumerate(timestamps):
+        start_time = timestamps[i - 1][1] if i > 0 else 0.0
+        if end_time - start_time > 0:
+            spans.append((word, start_time, end_time))
+    return spans
+
+def get_video_size(input_path: str):
+    stream = next(stream for stream in ffmpeg.probe(input_path)["streams"] if stream.get("codec_type") == "video")
+    return int(stream["width"]), int(stream["height"])
+
+def burn_subtitles(video, ass_path: str):
+    """ libass로 ASS 자막을 입힙니다. 폰트는 static/fonts 에서 찾습니다. """
+    return video.filter("subtitles", ass_path, fontsdir=os.path.dirname(SUBTITLE_FONT_PATH))
+
+def draw_subtitles(video, timestamps):
+    for word, start_time, end_time in get_subtitle_spans(timestamps):
+        video = video.drawtext(
+            text=word,
+            fontfile=SUBTITLE_FONT_PATH,
+            fontsize=SUBTITLE_FONT_SIZE,
+            fontcolor="white",
+            borderw=SUBTITLE_STROKE_WIDTH,
+            bordercolor="black",
+            x="(w-text_w)/2",
+            y=SUBTITLE_TOP,
+            enable=f"between(t,{start_time:.3f},{end_time:.3f})")
+    return video
+
+def ffmpeg_burn_subtitles(video_path: str, audio_path: str, ass_path: str, output_path: str,
+                          encoding: EncodingProfile = None):
+    """ 병합된 영상에 ASS 자막을 입히고 오디오를 붙여 인코딩합니다. MoviePy 합성을 대신합니다. """
+    encoding = encoding or EncodingProfile()
+    video = encoding.scale(burn_subtitles(ffmpeg.input(video_path).video, ass_path))
+    audio = ffmpeg.input(audio_path).audio
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    (ffmpeg
+        .output(video, audio, output_path, shortest=None, movflags="+faststart", **encoding.to_ffmpeg_args())
+        .global_args("-y", "-loglevel", "error")
+        .run())
+
+def ffmpeg_render_single_pass(video_path_list: list[str], video_length_sec: int, audio_path_list: list[str],
+                              audio_inpoint_sec: float, timestamps, output_path: str, ass_path: str = None,
+                              encoding: EncodingProfile = None):
+    """
+    자르기 + 영상 병합 + 오디오 병합 + 자막 + 인코딩을 ffmpeg filtergraph 하나로 처리합니다.
+    중간 파일 없이 한 번 디코딩 / 인코딩해서 output_path만 씁니다.
+    """
+    # provider가 섞이면 크기 / 비율 / 프레임레이트가 다르므로 첫 클립 형식에 맞춥니다.
+    uniform_format = get_uniform_format(probe_video(video_path_list[0]))
+    video_streams = []
+    for video_path in video_path_list:
+        stream = ffmpeg.input(video_path).video
+        if video_length_sec > 0:
+            stream = stream.trim(duration=video_length_sec)
+        video_streams.append(fit_video(stream.setpts("PTS-STARTPTS"), uniform_format))
+    video = ffmpeg.concat(*video_streams, v=1, a=0)
+
+    audio_streams = []
+    for audio_path in audio_path_list:
+        stream = ffmpeg.input(audio_path).audio
+        if audio_inpoint_sec > 0:
+            stream = stream.filter("atrim", start=audio_inpoint_sec)
+        audio_streams.append(stream.filter("asetpts", "PTS-STARTPTS"))
+    audio = ffmpeg.concat(*audio_streams, v=0, a=1)
+
+    # ASS 파일이 있으면 필터 하나로, 없으면 단어마다 drawtext로 그립니다.
+    if ass_path:
+        video = burn_subtitles(video, ass_path)
+    else:
+        video = draw_subtitles(video, timestamps)
+    encoding = encoding or EncodingProfile()
+    video = encoding.scale(video)
+
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    (ffmpeg
+        .output(video, audio, output_path, shortest=None, movflags="+faststart", **encoding.to_ffmpeg_args())
+        .global_args("-y", "-loglevel", "error")
+        .run())
 
 def synthesize_speech(text: str, duration_sec: float):
     #return [(text, duration)] # 이거는 문장 단위로 자르기
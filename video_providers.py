@@ -0,0 +1,299 @@
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+
+import genClients
+from config import get_config
+from dee_pool import get_dee_concurrency, get_dee_token_pool, get_dee_tokens, parse_token_list
+from deeClient import DEE_PROVIDER, DEE_RESOLUTION, DEE_LENGTH_SEC
+from downloader import verify_video
+from metrics import observe_call
+
+VEO_PROVIDER = "veo"
+
+LATENCY_WINDOW = 50
+MIN_LATENCY_SAMPLES = 5
+ERROR_ALPHA = 0.2
+CANCEL_CHECK_SEC = 1.0
+
+
+class ClipCancelled(Exception):
+    """ hedging에서 다른 provider가 먼저 끝나서 그만둔 요청입니다. """
+    pass
+
+
+class ProviderStats:
+    """ 최근 성공한 요청들의 소요 시간과 에러 비율(EWMA)입니다. 프로세스마다 따로 집계합니다. """
+
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.error_rate = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.inflight = 0
+
+    def p90(self):
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+
+
+class VideoProvider(ABC):
+    name = ""
+    resolution = ""
+    length_sec = 0
+    # 측정값이 모이기 전에 쓰는 예상 소요 시간
+    default_latency_sec = 120.0
+
+    def __init__(self):
+        self.stats = ProviderStats()
+
+    def is_configured(self) -> bool:
+        return True
+
+    def has_quota(self) -> bool:
+        return True
+
+    def capacity(self) -> int:
+        return 1
+
+    @abstractmethod
+    def generate(self, task, index: int, prompt: str, output_path: str, allow_stream_cut: bool,
+                 cancel_event: threading.Event):
+        """ cancel_event가 set되면 가능한 빨리 ClipCancelled를 던지고, 그 뒤로는 task 상태를 바꾸지 않아야 합니다. """
+
+    def expected_latency(self) -> float:
+        p90 = self.stats.p90()
+        return p90 if p90 is not None else self.default_latency_sec
+
+    def score(self) -> float:
+        """ 낮을수록 좋습니다. 실패하면 다시 해야 하므로 에러 비율만큼 예상 시간을 늘립니다. """
+        return self.expected_latency() / max(1.0 - self.stats.error_rate, 0.05)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "configured": self.is_configured(),
+            "has_quota": self.has_quota(),
+            "inflight": self.stats.inflight,
+            "successes": self.stats.successes,
+            "failures": self.stats.failures,
+            "error_rate": round(self.stats.error_rate, 3),
+            "p90_sec": self.stats.p90(),
+        }
+
+
+class DeeProvider(VideoProvider):
+    name = DEE_PROVIDER
+    resolution = DEE_RESOLUTION
+    length_sec = DEE_LENGTH_SEC
+    default_latency_sec = 120.0
+
+    def is_configured(self) -> bool:
+        return bool(get_dee_tokens())
+
+    def has_quota(self) -> bool:
+        return get_dee_token_pool().available_count() > 0
+
+    def capacity(self) -> int:
+        return get_dee_concurrency()
+
+    def generate(self, task, index: int, prompt: str, output_path: str, allow_stream_cut: bool,
+                 cancel_event: threading.Event):
+        # 업로드 / 제출 상태를 info.json에 남기며 이어서 진행해야 하므로 task가 직접 처리합니다.
+        task.generate_dee_clip(index, prompt, output_path, allow_stream_cut, cancel_event)
+
+
+class VeoProvider(VideoProvider):
+    name = VEO_PROVIDER
+    resolution = genClients.VEO_RESOLUTION
+    length_sec = genClients.VEO_LENGTH_SEC
+    default_latency_sec = 180.0
+
+    def is_configured(self) -> bool:
+        return bool(genClients.genai_clients)
+
+    def has_quota(self) -> bool:
+        return self.stats.inflight < self.capacity()
+
+    def capacity(self) -> int:
+        return max(1, int(get_config("veo_max_inflight", 2)))
+
+    def to_dict(self):
+        result = super().to_dict()
+        if self.is_configured():
+            engine = genClients.get_veo_engine_if_started()
+            if engine:
+                result["keys"] = engine.to_dict()
+            else:
+                # /api/stats 조회만으로 이벤트 루프 스레드를 띄우지 않습니다.
+                result["engine"] = "not started"
+        return result
+
+    def generate(self, task, index: int, prompt: str, output_path: str, allow_stream_cut: bool,
+                 cancel_event: threading.Event):
+        future = genClients.get_veo_engine().submit(task.get_image_path(index), prompt, output_path)
+        while True:
+            try:
+                future.result(timeout=CANCEL_CHECK_SEC)
+                break
+            except FutureTimeoutError:
+                if future.done():
+                    raise
+                if cancel_event.is_set():
+                    # 이벤트 루프의 생성 작업도 같이 취소합니다.
+                    future.cancel()
+                    raise ClipCancelled(f"veo clip {index} cancelled")
+        verify_video(output_path)
+
+
+class VideoProviderRouter:
+    """
+    클립마다 쿼터가 남아 있고 예상 시간(p90 / 성공률)이 가장 짧은 provider를 고릅니다.
+    hedging을 켜면 첫 provider가 p90 안에 끝나지 않을 때 두 번째 provider에도 요청하고 먼저 끝난 결과를 씁니다.
+    """
+
+    def __init__(self, providers: list[VideoProvider]):
+        self.providers = {provider.name: provider for provider in providers}
+        self.lock = threading.Lock()
+
+    def get_enabled(self) -> list[VideoProvider]:
+        names = parse_token_list(get_config("video_providers", [DEE_PROVIDER]))
+        return [self.providers[name] for name in names
+                if name in self.providers and self.providers[name].is_configured()]
+
+    def capacity(self) -> int:
+        return sum(provider.capacity() for provider in self.get_enabled())
+
+    def rank(self, providers: list[VideoProvider], preferred: str = None) -> list[VideoProvider]:
+        """ preferred는 이미 제출해둔 작업이 있는 provider로, 쿼터와 상관없이 맨 앞에 둡니다. """
+        return sorted(providers, key=lambda provider: (
+            provider.name != preferred,
+            not provider.has_quota(),
+            provider.score()))
+
+    def call(self, provider: VideoProvider, attempt, cancel_event: threading.Event):
+        with self.lock:
+            provider.stats.inflight += 1
+        started_at = time.time()
+        success = False
+        try:
+            with observe_call(provider.name, "clip"):
+                attempt(provider, cancel_event)
+            success = True
+        finally:
+            # 취소된 요청은 성공도 실패도 아니므로 통계에 넣지 않습니다.
+            self.record(provider, time.time() - started_at, None if cancel_event.is_set() and not success else success)
+
+    def record(self, provider: VideoProvider, elapsed: float, success):
+        with self.lock:
+            stats = provider.stats
+            stats.inflight -= 1
+            if success is None:
+                return
+            if success:
+                stats.successes += 1
+                stats.latencies.append(elapsed)
+            else:
+                stats.failures += 1
+            stats.error_rate += ERROR_ALPHA * ((0.0 if success else 1.0) - stats.error_rate)
+
+    def run(self, providers: list[VideoProvider], attempt, hedging: bool = False, on_discard=None) -> VideoProvider:
+        """
+        attempt(provider, cancel_event)로 클립을 생성하고 성공한 provider를 돌려줍니다.
+        :param on_discard: hedging에서 진 provider가 취소되기 전에 성공했을 때 결과를 정리할 callback(provider)
+        """
+        if not providers:
+            raise Exception("No video provider available")
+        if hedging and len(providers) > 1:
+            return self.run_hedged(providers[0], providers[1:], attempt, on_discard)
+
+        last_error = None
+        for provider in providers:
+            try:
+                self.call(provider, attempt, threading.Event())
+                return provider
+            except Exception as e:
+                logging.warning(f"video provider {provider.name} failed: {e}")
+                last_error = e
+        raise last_error
+
+    def run_hedged(self, primary: VideoProvider, fallbacks: list[VideoProvider], attempt, on_discard=None):
+        executor = ThreadPoolExecutor(max_workers=1 + len(fallbacks), thread_name_prefix="hedge")
+        fallbacks = list(fallbacks)
+        future_to_provider = {}
+        cancel_events = {}
+
+        def start(provider: VideoProvider):
+            cancel_event = threading.Event()
+            future = executor.submit(self.call, provider, attempt, cancel_event)
+            future_to_provider[future] = provider
+            cancel_events[future] = cancel_event
+            return future
+
+        try:
+            pending = {start(primary)}
+            hedge_allowed = True
+            last_error = None
+            while pending:
+                timeout = None
+                if fallbacks and hedge_allowed:
+                    timeout = max(future_to_provider[future].expected_latency() for future in pending)
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logging.warning(f"video provider {future_to_provider[future].name} failed: {e}")
+                        last_error = e
+                        continue
+                    for loser_future in pending:
+                        # 진 쪽은 취소 신호를 받은 뒤로 task 상태를 바꾸지 않고 곧 끝납니다.
+                        cancel_events[loser_future].set()
+                        loser = future_to_provider[loser_future]
+                        loser_future.add_done_callback(lambda f, loser=loser: self.discard(f, loser, on_discard))
+                    return future_to_provider[future]
+
+                if not fallbacks:
+                    continue
+                if not pending:
+                    # 실행 중인 요청이 모두 실패했으면 다음 provider로 넘어갑니다.
+                    pending.add(start(fallbacks.pop(0)))
+                elif not done:
+                    # p90 안에 끝나지 않았으면 다음 provider에도 요청합니다.
+                    if fallbacks[0].has_quota():
+                        logging.info(f"hedging clip to {fallbacks[0].name}")
+                        pending.add(start(fallbacks.pop(0)))
+                    else:
+                        hedge_allowed = False
+            raise last_error
+        finally:
+            # 진 쪽 요청은 취소 신호를 확인할 때까지 백그라운드에서 끝나게 둡니다.
+            executor.shutdown(wait=False)
+
+    def discard(self, future, provider: VideoProvider, on_discard):
+        if on_discard is None or future.cancelled() or future.exception() is not None:
+            return
+        try:
+            on_discard(provider)
+        except Exception as e:
+            logging.error(f"discard {provider.name} result: {e}")
+
+    def to_dict(self):
+        return [provider.to_dict() for provider in self.providers.values()]
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_video_router() -> VideoProviderRouter:
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = VideoProviderRouter([DeeProvider(), VeoProvider()])
+        return _router